@@ -0,0 +1,214 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+DOCUMENTATION = """
+    name: deploy_profile
+    type: aggregate
+    short_description: Write a profile of the deployment into a JSON file
+    description:
+      - Records the duration, status, number of items and number of API calls
+        of every task, aggregates them per task file (phase) and per deployed
+        component, and writes the report at the end of the playbook.
+      - Compare two reports with scripts/compare_deploy_profiles.py.
+    requirements:
+      - enable in configuration, e.g. 'make profile-deploy'
+    options:
+      output:
+        description: Path of the JSON report.
+        default: deploy-profile.json
+        env:
+          - name: DEPLOY_PROFILE
+        ini:
+          - section: callback_deploy_profile
+            key: output
+"""
+
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from ansible import context
+from ansible.plugins.callback import CallbackBase
+from ansible.release import __version__ as ansible_version
+
+# modules talking to the API server or the registry, one call per item
+API_ACTIONS = {
+    "k8s",
+    "k8s_info",
+    "kubernetes.core.k8s",
+    "kubernetes.core.k8s_info",
+    "uri",
+    "ansible.builtin.uri",
+}
+ASYNC_STATUS_ACTIONS = {"async_status", "ansible.builtin.async_status"}
+# commands running oc (e.g. 'oc apply' in tasks/k8s.yml) call the API server too
+COMMAND_ACTIONS = {"command", "ansible.builtin.command"}
+
+
+def is_api_call(task) -> bool:
+    if task.action in API_ACTIONS:
+        return True
+    if task.action not in COMMAND_ACTIONS:
+        return False
+    argv = task.args.get("argv") or str(task.args.get("_raw_params", "")).split()
+    return bool(argv) and argv[0] == "oc"
+
+
+def get_component(result: dict):
+    """Component of a loop item, see tasks/k8s.yml and tasks/deploy-wave.yml."""
+    item = result.get(result.get("ansible_loop_var", "item"))
+    if not isinstance(item, dict):
+        return None
+    # async_status of an object applied by tasks/k8s.yml
+    item = item.get("k8s_object", item)
+    return item.get("component")
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "deploy_profile"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super().__init__()
+        self.start = time.monotonic()
+        self.started_at = datetime.now(timezone.utc)
+        self.tasks = []
+        self.current = None
+        self.includes = 0
+        self.components = defaultdict(
+            lambda: {"objects": 0, "api_calls": 0, "first": None, "last": None}
+        )
+
+    def _elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def _finish_task(self):
+        if self.current:
+            self.current["duration"] = self._elapsed() - self.current["start"]
+            self.tasks.append(self.current)
+            self.current = None
+
+    def _start_task(self, task, handler=False):
+        self._finish_task()
+        self.current = {
+            "name": task.get_name().strip(),
+            "path": task.get_path(),
+            "action": task.action,
+            "handler": handler,
+            "start": self._elapsed(),
+            "duration": 0.0,
+            "items": 0,
+            "api_calls": 0,
+            "status": "ok",
+        }
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._start_task(task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._start_task(task, handler=True)
+
+    def v2_playbook_on_include(self, included_file):
+        self.includes += 1
+
+    def _record(self, result, status, is_item=False):
+        if not self.current:
+            return
+        if status != "ok":
+            self.current["status"] = status
+        if status == "skipped":
+            return
+        res = result._result
+        if is_item:
+            self.current["items"] += 1
+        elif res.get("results") is not None:
+            # the summary of a loop, items have been counted already
+            return
+        action = self.current["action"]
+        api_call = is_api_call(result._task)
+        if api_call:
+            self.current["api_calls"] += 1
+        # None for no_log items too, their loop variable is censored
+        component = get_component(res) if is_item else None
+        if not component:
+            return
+        stats = self.components[component]
+        if (
+            action in ASYNC_STATUS_ACTIONS
+            and result._task.args.get("mode") == "cleanup"
+        ):
+            # every object applied by tasks/k8s.yml has its async job cleaned up,
+            # the launch (an 'oc apply') and the wait for Secrets are no_log
+            stats["objects"] += 1
+            stats["api_calls"] += 1
+            if stats["first"] is not None:
+                return
+        now = self._elapsed()
+        if stats["first"] is None:
+            stats["first"] = now
+        stats["last"] = now
+        stats["api_calls"] += api_call
+
+    def v2_runner_on_ok(self, result):
+        self._record(result, "ok")
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result, "ignored" if ignore_errors else "failed")
+
+    def v2_runner_on_skipped(self, result):
+        self._record(result, "skipped")
+
+    def v2_runner_on_unreachable(self, result):
+        self._record(result, "failed")
+
+    def v2_runner_item_on_ok(self, result):
+        self._record(result, "ok", is_item=True)
+
+    def v2_runner_item_on_failed(self, result):
+        self._record(
+            result, "ignored" if result._task.ignore_errors else "failed", is_item=True
+        )
+
+    def v2_runner_item_on_skipped(self, result):
+        self._record(result, "skipped", is_item=True)
+
+    def v2_playbook_on_stats(self, stats):
+        self._finish_task()
+        phases = defaultdict(lambda: {"duration": 0.0, "tasks": 0, "api_calls": 0})
+        for task in self.tasks:
+            phase = phases[task["path"].rsplit(":", 1)[0].rsplit("/", 1)[-1]]
+            phase["duration"] += task["duration"]
+            phase["tasks"] += 1
+            phase["api_calls"] += task["api_calls"]
+
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "duration": self._elapsed(),
+            "ansible_version": ansible_version,
+            "run_tags": sorted(context.CLIARGS.get("tags") or ["all"]),
+            "includes": self.includes,
+            "api_calls": sum(task["api_calls"] for task in self.tasks),
+            "phases": dict(phases),
+            "components": {
+                name: {
+                    "objects": stats["objects"],
+                    "api_calls": stats["api_calls"],
+                    "started": stats["first"],
+                    "finished": stats["last"],
+                    "duration": stats["last"] - stats["first"],
+                }
+                for name, stats in self.components.items()
+            },
+            "tasks": self.tasks,
+        }
+        output = Path(self.get_option("output"))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self._display.display(
+            f"Deploy profile written to {output}: {report['duration']:.1f}s, "
+            f"{len(self.tasks)} tasks, {report['api_calls']} API calls"
+        )
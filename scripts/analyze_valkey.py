@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "redis",
+# ]
+# ///
+
+"""Analyze Valkey/Redis data and identify old/unnecessary data.
+
+The whole keyspace is walked by a single SCAN pass, with the type, TTL
+and memory usage of the keys fetched in pipelined batches; all the
+sections of the report are built from that one pass.
+"""
+
+import fnmatch
+import heapq
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO, Tuple
+
+import click
+import redis
+
+import kv_database
+import valkey_history
+
+# upper bounds (in seconds) of the TTL buckets
+TTL_BUCKETS: List[Tuple[Optional[int], str]] = [
+    (60 * 60, "< 1 hour"),
+    (24 * 60 * 60, "< 1 day"),
+    (7 * 24 * 60 * 60, "< 1 week"),
+    (30 * 24 * 60 * 60, "< 30 days"),
+    (None, ">= 30 days"),
+]
+# UUIDs, hashes and numbers in the keys are replaced to group similar keys
+KEY_GROUP_RE = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{32,}|\d+"
+)
+DISK_USAGE_WARNING = 80
+CELERY_META_WARNING = 10000
+
+
+def get_ttl_bucket(ttl: int) -> str:
+    for limit, name in TTL_BUCKETS:
+        if limit is None or ttl < limit:
+            return name
+
+
+@dataclass
+class KeyStats:
+    count: int = 0
+    memory: int = 0
+    no_expiry: int = 0
+    # keys which disappeared between SCAN and the pipelined commands
+    missing: int = 0
+    ttl_buckets: Counter = field(default_factory=Counter)
+    types: Counter = field(default_factory=Counter)
+
+    def add(self, key_type: str, ttl: int, memory: int) -> None:
+        if ttl == -2:
+            self.missing += 1
+            return
+        self.count += 1
+        self.memory += memory
+        self.types[key_type] += 1
+        if ttl == -1:
+            self.no_expiry += 1
+        else:
+            self.ttl_buckets[get_ttl_bucket(ttl)] += 1
+
+    @property
+    def with_ttl(self) -> int:
+        return self.count - self.no_expiry
+
+
+@dataclass
+class KeyspaceAnalysis:
+    top: int = 20
+    total: KeyStats = field(default_factory=KeyStats)
+    patterns: Dict[str, KeyStats] = field(
+        default_factory=lambda: {
+            pattern: KeyStats() for pattern in kv_database.PATTERNS
+        }
+    )
+    groups: Dict[str, KeyStats] = field(default_factory=dict)
+    # min-heap of (memory, key, type) of the largest keys
+    largest: List[Tuple[int, str, str]] = field(default_factory=list)
+    duration: float = 0.0
+
+    def add(self, key: str, key_type: str, ttl: int, memory: int) -> None:
+        self.total.add(key_type, ttl, memory)
+        if ttl == -2:
+            return
+        for pattern, stats in self.patterns.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                stats.add(key_type, ttl, memory)
+        group = KEY_GROUP_RE.sub("*", key)
+        self.groups.setdefault(group, KeyStats()).add(key_type, ttl, memory)
+
+        item = (memory, key, key_type)
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, item)
+        elif item > self.largest[0]:
+            heapq.heapreplace(self.largest, item)
+
+
+def analyze_keyspace(
+    client: redis.Redis, batch_size: int = kv_database.SCAN_COUNT, top: int = 20
+) -> KeyspaceAnalysis:
+    analysis = KeyspaceAnalysis(top=top)
+    start = time.monotonic()
+    seen = 0
+    for keys in kv_database.scan_batches(client, count=batch_size):
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.type(key)
+            pipeline.ttl(key)
+            pipeline.memory_usage(key)
+        # e.g. MEMORY USAGE may be disabled, don't fail the whole analysis
+        results = [
+            None if isinstance(result, Exception) else result
+            for result in pipeline.execute(raise_on_error=False)
+        ]
+        for i, key in enumerate(keys):
+            key_type, ttl, memory = results[3 * i : 3 * i + 3]
+            analysis.add(
+                kv_database.decode_key(key),
+                key_type.decode() if key_type else "unknown",
+                -2 if ttl is None else ttl,
+                memory or 0,
+            )
+        seen += len(keys)
+        click.echo(f"\r  scanned {seen} keys", nl=False, err=True)
+    click.echo(err=True)
+    analysis.duration = time.monotonic() - start
+    return analysis
+
+
+def format_bytes(size: float) -> str:
+    for unit in ["B", "K", "M", "G"]:
+        if abs(size) < 1024:
+            return f"{size:.2f}{unit}" if unit != "B" else f"{size:.0f}B"
+        size /= 1024
+    return f"{size:.2f}T"
+
+
+def percent(part: int, whole: int) -> str:
+    return f"{100 * part / whole:.1f}%" if whole else "n/a"
+
+
+class Report:
+    """Writes the report both to the console and to the output file."""
+
+    def __init__(self, output: TextIO) -> None:
+        self.output = output
+
+    def __call__(self, line: str = "") -> None:
+        click.echo(line)
+        self.output.write(f"{line}\n")
+
+    def section(self, title: str) -> None:
+        click.secho(f"[{datetime.now():%H:%M:%S}] {title}", fg="blue", err=True)
+        self("==========================================")
+        self(title)
+        self("==========================================")
+
+    def stats(self, stats: KeyStats, indent: str = "  ") -> None:
+        self(
+            f"{indent}keys: {stats.count}, memory: {format_bytes(stats.memory)}, "
+            f"without expiry: {stats.no_expiry} ({percent(stats.no_expiry, stats.count)})"
+        )
+        if stats.ttl_buckets:
+            self(
+                f"{indent}TTL: "
+                + ", ".join(
+                    f"{name}: {stats.ttl_buckets[name]}"
+                    for _, name in TTL_BUCKETS
+                    if stats.ttl_buckets[name]
+                )
+            )
+
+
+def warning(message: str) -> None:
+    click.secho(f"[WARNING] {message}", fg="yellow", err=True)
+
+
+@click.command()
+@kv_database.connection_options
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Path to save the report  [default: valkey-analysis-report-TIMESTAMP.txt]",
+)
+@click.option(
+    "--batch-size",
+    default=kv_database.SCAN_COUNT,
+    show_default=True,
+    help="Number of keys requested by a SCAN call and pipelined at once.",
+)
+@click.option(
+    "--top",
+    default=20,
+    show_default=True,
+    help="Number of the largest keys and key groups to report.",
+)
+@click.option(
+    "--history/--no-history",
+    default=True,
+    show_default=True,
+    help="Append a snapshot of the statistics to the history store.",
+)
+@click.option(
+    "--store",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=valkey_history.STORE_PATH,
+    show_default=True,
+    help="History store, see valkey_history.py.",
+)
+def analyze(
+    namespace, component, host, port, db, output, batch_size, top, history, store
+):
+    """Analyze Valkey/Redis data and identify old/unnecessary data.
+
+    By default, the database pod in the OpenShift namespace is reached
+    through a port-forward; use --host to analyze e.g. a local container.
+
+    Unless --no-history is given, a snapshot of the statistics is appended
+    to the history store, see 'valkey_history.py trend' for the growth.
+    """
+    output = output or f"valkey-analysis-report-{datetime.now():%Y%m%d-%H%M%S}.txt"
+    with open(output, "w") as output_file, kv_database.connect(
+        namespace, component, host, port, db
+    ) as client:
+        report = Report(output_file)
+        report("==========================================")
+        report("Valkey Data Analysis Report")
+        report("==========================================")
+        report(f"Generated: {datetime.now()}")
+        report(f"Database: {host}:{port}" if host else f"Namespace: {namespace}")
+        report("==========================================")
+        report()
+
+        report.section("1. DISK USAGE")
+        disk = None
+        disk_usage_percent = None
+        if host:
+            report("Skipped, not available for a direct connection.")
+        else:
+            # a single 'oc exec', reused for the history snapshot
+            disk = valkey_history.get_disk(namespace, component)
+            disk_used, disk_size, rdb_size = disk
+            disk_usage_percent = (
+                round(100 * disk_used / disk_size) if disk_size else None
+            )
+            report(
+                f"/data: {format_bytes(disk_used)} used of {format_bytes(disk_size)}"
+                f" ({disk_usage_percent}%)"
+            )
+            report()
+            report("RDB Persistence File Size:")
+            report(
+                format_bytes(rdb_size) if rdb_size is not None else "No dump.rdb found"
+            )
+            if disk_usage_percent and disk_usage_percent > DISK_USAGE_WARNING:
+                warning(
+                    f"Disk usage is at {disk_usage_percent}% - "
+                    "Consider cleanup or expansion"
+                )
+        report()
+
+        report.section("2. MEMORY STATISTICS")
+        memory_info = client.info("memory")
+        for name, value in memory_info.items():
+            report(f"{name}:{value}")
+        report()
+        report("Key Memory Metrics:")
+        report(f"  - Used Memory: {memory_info.get('used_memory_human')}")
+        report(f"  - RSS Memory: {memory_info.get('used_memory_rss_human')}")
+        report(f"  - Peak Memory: {memory_info.get('used_memory_peak_human')}")
+        report()
+
+        report.section("3. KEYSPACE STATISTICS")
+        for name, value in client.info("keyspace").items():
+            report(f"{name}:{value}")
+        report()
+        analysis = analyze_keyspace(client, batch_size, top)
+        stats = analysis.total
+        report(f"Total Keys: {stats.count} " f"(scanned in {analysis.duration:.1f}s)")
+        report(f"Total Memory of Keys: {format_bytes(stats.memory)}")
+        report(
+            "By Type: "
+            + ", ".join(f"{name}: {count}" for name, count in stats.types.most_common())
+        )
+        if stats.missing:
+            report(f"Keys expired/deleted while scanning: {stats.missing}")
+        report()
+        if stats.count == 0:
+            warning("No keys found in database!")
+
+        report.section("4. KEY PATTERN ANALYSIS")
+        report(f"Top {top} key groups by memory:")
+        for group, group_stats in sorted(
+            analysis.groups.items(), key=lambda item: item[1].memory, reverse=True
+        )[:top]:
+            report(f"- {group}")
+            report.stats(group_stats)
+        report()
+
+        report.section("5. CELERY TASK ANALYSIS")
+        celery_meta = analysis.patterns[kv_database.CELERY_META_PATTERN]
+        report(f"Celery Task Metadata Keys: {celery_meta.count}")
+        if celery_meta.count:
+            report.stats(celery_meta)
+            if celery_meta.no_expiry:
+                warning(
+                    f"Found {celery_meta.no_expiry} celery-task-meta keys "
+                    "without expiry! These will accumulate forever."
+                )
+        report()
+        for pattern in kv_database.PATTERNS:
+            if (
+                pattern != kv_database.CELERY_META_PATTERN
+                and analysis.patterns[pattern].count
+            ):
+                report(f"Keys matching '{pattern}':")
+                report.stats(analysis.patterns[pattern])
+        report()
+
+        report.section("6. LARGEST KEYS")
+        for memory, key, key_type in sorted(analysis.largest, reverse=True):
+            report(f"  - {key} | Type: {key_type} | Memory: {format_bytes(memory)}")
+        report()
+
+        report.section("7. CELERY QUEUE ANALYSIS")
+        pipeline = client.pipeline(transaction=False)
+        for queue in kv_database.QUEUES:
+            pipeline.llen(queue)
+        for queue, length in zip(
+            kv_database.QUEUES, pipeline.execute(raise_on_error=False)
+        ):
+            if isinstance(length, int) and length:
+                report(f"Queue '{queue}': {length} tasks pending")
+        report()
+
+        report.section("8. TTL DISTRIBUTION (all keys)")
+        report(
+            f"Keys without expiry (TTL -1): {stats.no_expiry} "
+            f"({percent(stats.no_expiry, stats.count)})"
+        )
+        report(f"Keys with TTL set: {stats.with_ttl}")
+        for _, name in TTL_BUCKETS:
+            report(f"  {name}: {stats.ttl_buckets[name]}")
+        report()
+        many_without_expiry = stats.count and stats.no_expiry * 2 > stats.count
+        if many_without_expiry:
+            warning(
+                "More than 50% of keys have no expiry! These will grow indefinitely."
+            )
+
+        report.section("9. PERSISTENCE & CONFIGURATION")
+        config = {}
+        for name in ["maxmemory", "maxmemory-policy", "save"]:
+            config.update(client.config_get(name))
+            report(f"{name}: {config.get(name)}")
+        report()
+        if config.get("maxmemory") == "0":
+            warning("No maxmemory limit set! Memory can grow unbounded.")
+        if config.get("maxmemory-policy") == "noeviction":
+            warning(
+                "maxmemory-policy is 'noeviction' - will cause errors when memory is full!"
+            )
+
+        report.section("10. RECOMMENDATIONS")
+        if disk_usage_percent and disk_usage_percent > DISK_USAGE_WARNING:
+            report(f"⚠️  URGENT: Disk usage is at {disk_usage_percent}%")
+            report("   - Consider immediate cleanup or PVC expansion")
+        if celery_meta.count > CELERY_META_WARNING:
+            report(f"⚠️  High number of Celery task metadata keys ({celery_meta.count})")
+            report("   - Ensure Celery result_expires is set properly")
+        if celery_meta.no_expiry:
+            report(
+                f"⚠️  {celery_meta.no_expiry} Celery task metadata keys without expiry"
+            )
+            report("   - Remove the old ones with scripts/reap_celery_results.py")
+        if config.get("maxmemory") == "0":
+            report("⚠️  No memory limit configured")
+            report("   - Set maxmemory to prevent OOM")
+            report("   - Set maxmemory-policy (e.g., allkeys-lru or volatile-lru)")
+        if many_without_expiry:
+            report("⚠️  Many keys without TTL detected")
+            report("   - Review key patterns and set appropriate expiry times")
+        report()
+        report("==========================================")
+        report("END OF REPORT")
+        report("==========================================")
+
+        if history:
+            snapshot = valkey_history.Snapshot(
+                target=valkey_history.get_target(namespace, host, port, db),
+                taken_at=time.time(),
+                used_memory=memory_info["used_memory"],
+                maxmemory=int(config.get("maxmemory") or 0),
+                keys=stats.count,
+                patterns={
+                    pattern: (pattern_stats.count, pattern_stats.memory)
+                    for pattern, pattern_stats in analysis.patterns.items()
+                },
+            )
+            if disk:
+                snapshot.disk_used, snapshot.disk_size, snapshot.rdb_size = disk
+            valkey_history.save_snapshot(valkey_history.open_store(store), snapshot)
+
+    click.secho(f"Analysis complete! Report saved to: {output}", fg="green", err=True)
+    click.echo()
+    click.echo("==========================================")
+    click.echo("QUICK SUMMARY")
+    click.echo("==========================================")
+    if disk_usage_percent is not None:
+        click.echo(f"Disk Usage: {disk_usage_percent}%")
+    click.echo(f"Total Keys: {stats.count}")
+    click.echo(f"Used Memory: {memory_info.get('used_memory_human')}")
+    click.echo(f"Celery Meta Keys: {celery_meta.count}")
+    click.echo(f"Full report: {output}")
+    click.echo("==========================================")
+
+
+if __name__ == "__main__":
+    analyze()
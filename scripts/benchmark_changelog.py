@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark of parsing merge commits for the changelog.
+
+Creates a synthetic repository with the requested number of merge commits
+(via git fast-import) and compares getting the pull requests with release
+notes through GitPython and the old multi-pass parsing with the streaming
+git-log parser used by changelog.py.
+
+    Example:
+    $ ./benchmark_changelog.py --merges 50000
+"""
+
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import click
+from git import Repo
+
+import changelog
+
+MESSAGES = [
+    "Add support for {name} (#{pr_id})\n\n"
+    "Fixes #1\n\nRELEASE NOTES BEGIN\nWe now support {name}.\nRELEASE NOTES END\n",
+    "Merge pull request #{pr_id} from someone/{name}\n\n"
+    "Refactor {name}\n\nRELEASE NOTES BEGIN\nN/A\nRELEASE NOTES END\n",
+    "Merge pull request #{pr_id} from someone/{name}\n\nFix {name}\n",
+    "[pre-commit.ci] pre-commit autoupdate (#{pr_id})\n\n"
+    "RELEASE NOTES BEGIN\nbump\nRELEASE NOTES END\n",
+]
+
+
+def create_repository(path: Path, merges: int) -> None:
+    subprocess.run(["git", "init", "-q", "-b", "main", str(path)], check=True)
+
+    def commit(mark: int, message: str, parents: list) -> bytes:
+        data = message.encode()
+        header = (
+            f"commit refs/heads/main\nmark :{mark}\n"
+            f"committer Packit <hello@packit.dev> {1600000000 + mark} +0000\n"
+            f"data {len(data)}\n"
+        ).encode()
+        footer = "".join(
+            f"{kind} :{parent}\n" for kind, parent in zip(["from", "merge"], parents)
+        ).encode()
+        return header + data + b"\n" + footer + b"\n"
+
+    stream = [commit(1, "Initial commit\n", [])]
+    mark = 1
+    for i in range(merges):
+        mainline = mark
+        stream.append(commit(mark + 1, f"Change {i}\n", [mainline]))
+        message = MESSAGES[i % len(MESSAGES)].format(name=f"feature-{i}", pr_id=i)
+        stream.append(commit(mark + 2, message, [mainline, mark + 1]))
+        mark += 2
+
+    subprocess.run(
+        ["git", "fast-import", "--quiet"], input=b"".join(stream), cwd=path, check=True
+    )
+
+
+def gitpython_parse(path: Path) -> list:
+    """The original way: a GitPython object per merge commit, the message
+    scanned several times."""
+    prs = []
+    for commit in Repo(path).iter_commits("main", merges=True):
+        if changelog.PRE_COMMIT_CI_MESSAGE in commit.message:
+            continue
+        message = changelog.convert_message(commit.message)
+        if message and message.lower() not in changelog.NOT_IMPORTANT_VALUES:
+            prs.append(changelog.get_pr_id(commit.message))
+    return prs
+
+
+def streaming_parse(path: Path) -> list:
+    return [
+        pr_id
+        for pr_id, release_note in map(
+            changelog.parse_message,
+            (c.message for c in changelog.iter_merge_commits(path, "main")),
+        )
+        if release_note
+    ]
+
+
+@click.command()
+@click.option(
+    "--merges",
+    default=50000,
+    show_default=True,
+    help="Number of merge commits in the synthetic repository",
+)
+def benchmark(merges: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, "repository")
+        start = time.monotonic()
+        create_repository(path, merges)
+        click.echo(
+            f"Created a repository with {merges} merges "
+            f"in {time.monotonic() - start:.2f}s"
+        )
+
+        results = {}
+        for name, parse in [
+            ("GitPython", gitpython_parse),
+            ("git-log", streaming_parse),
+        ]:
+            start = time.monotonic()
+            results[name] = parse(path)
+            click.echo(
+                f"{name:>10}: {time.monotonic() - start:.2f}s, "
+                f"{len(results[name])} pull requests with release notes"
+            )
+
+        if results["GitPython"] != results["git-log"]:
+            raise click.ClickException("The parsers don't agree on the results!")
+
+
+if __name__ == "__main__":
+    benchmark()
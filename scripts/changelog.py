@@ -3,24 +3,181 @@
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
 
+import json
 import os
 import re
-from typing import Iterable, Optional
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import click
+import requests
 from git import Commit, Repo
 from pathlib import Path
 from ogr import GithubService
+from ogr.abstract import GitProject
 
 NOT_IMPORTANT_VALUES = ["n/a", "none", "none.", ""]
 RELEASE_NOTES_TAG = "RELEASE NOTES"
 RELEASE_NOTES_RE = f"{RELEASE_NOTES_TAG} BEGIN\r?\n(.+)\r?\n{RELEASE_NOTES_TAG} END"
 PRE_COMMIT_CI_MESSAGE = "pre-commit autoupdate"
+RELEASE_NOTES_PATTERN = re.compile(RELEASE_NOTES_RE, re.DOTALL)
+# Sanitize changelog entry when updating dist-git spec file (#1841)
+PR_ID_NEW_PATTERN = re.compile(r"^.*\(\#(\d+)\)$")
+# size of chunks read from the output of git-log
+GIT_LOG_CHUNK_SIZE = 1024 * 1024
+
+CACHE_DIR = (
+    Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "packit-changelog"
+)
+# descriptions of merged PRs change rarely, keep them for a month
+PR_CACHE_TTL = 30 * 24 * 60 * 60
+PR_CACHE_MAX_ENTRIES = 5000
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+# number of pull requests fetched by a single GraphQL query
+GRAPHQL_BATCH_SIZE = 50
+# don't drain the whole rate limit, wait for the reset instead
+GRAPHQL_MIN_REMAINING = 100
+GRAPHQL_MAX_ATTEMPTS = 3
+REST_FALLBACK_WORKERS = 8
+
+
+class MergeCommit(NamedTuple):
+    """Merge commit as read from git-log, has the attributes of GitPython's
+    Commit used for getting the changelog."""
+
+    hexsha: str
+    message: str
+
+
+class ParsedMessage(NamedTuple):
+    pr_id: Optional[str]
+    release_note: Optional[str]
+
+
+class PRDescriptionCache:
+    """Persistent cache of PR descriptions.
+
+    Entries are keyed by the repository, the PR ID and the SHA of the merge
+    commit. Expired entries are dropped and the least recently used ones are
+    evicted when the cache grows over the limit on save.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        ttl: int = PR_CACHE_TTL,
+        max_entries: int = PR_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.path = path or CACHE_DIR / "pr-descriptions.json"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: Dict[str, dict] = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def __enter__(self) -> "PRDescriptionCache":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.save()
+
+    @staticmethod
+    def key(repo: str, pr_id: str, sha: str) -> str:
+        return f"{repo}#{pr_id}@{sha}"
+
+    def load(self) -> None:
+        try:
+            with self.path.open() as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, repo: str, pr_id: str, sha: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(self.key(repo, pr_id, sha))
+            now = time.time()
+            if entry is None or now - entry["fetched"] > self.ttl:
+                return None
+            entry["used"] = now
+            self.dirty = True
+            return entry["description"]
+
+    def set(self, repo: str, pr_id: str, sha: str, description: str) -> None:
+        with self.lock:
+            now = time.time()
+            self.entries[self.key(repo, pr_id, sha)] = {
+                "description": description,
+                "fetched": now,
+                "used": now,
+            }
+            self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            now = time.time()
+            entries = sorted(
+                (
+                    (key, entry)
+                    for key, entry in self.entries.items()
+                    if now - entry["fetched"] <= self.ttl
+                ),
+                key=lambda item: item[1]["used"],
+                reverse=True,
+            )
+            self.entries = dict(entries[: self.max_entries])
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump(self.entries, f)
+            tmp_path.replace(self.path)
+            self.dirty = False
+
+
+def iter_merge_commits(
+    git_repo: Union[str, Path], rev: str, since: Optional[str] = None
+) -> Iterator[MergeCommit]:
+    """Stream merge commits from the output of a single git-log process
+    instead of creating a GitPython object for each of them."""
+    command = ["git", "log", "--merges", "-z", "--format=%H%n%B"]
+    if since:
+        command.append(f"--since={since}")
+    command.append(rev)
+
+    with subprocess.Popen(
+        command,
+        cwd=git_repo,
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+        errors="replace",
+    ) as git_log:
+        remainder = ""
+        while chunk := git_log.stdout.read(GIT_LOG_CHUNK_SIZE):
+            *records, remainder = (remainder + chunk).split("\0")
+            for record in records:
+                hexsha, _, message = record.partition("\n")
+                yield MergeCommit(hexsha, message)
+        if remainder:
+            hexsha, _, message = remainder.partition("\n")
+            yield MergeCommit(hexsha, message)
+
+    if git_log.returncode:
+        raise click.ClickException(f"git log {rev} failed")
 
 
 def get_relevant_commits(
     repository: Repo, ref: Optional[str] = None
-) -> Iterable[Commit]:
+) -> Iterable[MergeCommit]:
     if not ref:
         tags = sorted(repository.tags, key=lambda t: t.commit.committed_datetime)
         if not tags:
@@ -30,7 +187,7 @@ def get_relevant_commits(
             )
         ref = tags[-1]
     ref_range = f"{ref}..HEAD"
-    return repository.iter_commits(rev=ref_range, merges=True)
+    return iter_merge_commits(repository.working_dir, ref_range)
 
 
 def get_pr_id_old(message: str) -> str:
@@ -43,7 +200,7 @@ def get_pr_id_old(message: str) -> str:
 def get_pr_id_new(message: str) -> str:
     # Sanitize changelog entry when updating dist-git spec file (#1841)
     first_line = message.split("\n")[0]
-    if match := re.match(r"^.*\(\#(\d+)\)$", first_line):
+    if match := PR_ID_NEW_PATTERN.match(first_line):
         return match.group(1)
     return ""
 
@@ -64,37 +221,196 @@ def get_pr_id(message: str) -> str:
 def convert_message(message: str) -> Optional[str]:
     """Extract release note from the commit message,
     return None if there is no release note"""
-    if RELEASE_NOTES_TAG in message:
-        # new
-        if found := re.findall(RELEASE_NOTES_RE, message, re.DOTALL):
-            return found[0].strip()
-        else:
-            return None
+    if match := RELEASE_NOTES_PATTERN.search(message):
+        return match.group(1).strip()
     return None
 
 
+def parse_message(message: str) -> ParsedMessage:
+    """Get the PR ID and the release note from the merge commit message.
+
+    The release note is None if the commit should be skipped: it has no or
+    an unimportant release note, or it's a pre-commit autoupdate.
+    The PR ID is looked for only when there's a release note.
+    """
+    if PRE_COMMIT_CI_MESSAGE in message:
+        return ParsedMessage(None, None)
+
+    match = RELEASE_NOTES_PATTERN.search(message)
+    if not match:
+        return ParsedMessage(None, None)
+    release_note = match.group(1).strip()
+    if release_note.lower() in NOT_IMPORTANT_VALUES:
+        return ParsedMessage(None, None)
+
+    first_line = message.partition("\n")[0]
+    if match := PR_ID_NEW_PATTERN.match(first_line):
+        return ParsedMessage(match.group(1), release_note)
+    # Merge pull request #1483 from majamassarini/fix/1357
+    return ParsedMessage(first_line.split(" ")[3].lstrip("#"), release_note)
+
+
+@lru_cache(maxsize=None)
+def get_service() -> GithubService:
+    return GithubService(token=os.getenv("GITHUB_TOKEN"))
+
+
+@lru_cache(maxsize=None)
+def get_project(repo: str) -> GitProject:
+    return get_service().get_project(namespace="packit", repo=repo)
+
+
 def get_message_from_pr(repo: str, pr_id: str) -> str:
-    service = GithubService(token=os.getenv("GITHUB_TOKEN"))
-    project = service.get_project(namespace="packit", repo=repo)
-    pr = project.get_pr(pr_id=int(pr_id))
+    pr = get_project(repo).get_pr(pr_id=int(pr_id))
     return pr.description
 
 
-def get_changelog(commits: Iterable[Commit], repo: str, make_link: bool = False) -> str:
-    changelog = ""
-    for commit in commits:
-        if PRE_COMMIT_CI_MESSAGE in commit.message:
-            continue
-        message = convert_message(commit.message)
-        if message and message.lower() not in NOT_IMPORTANT_VALUES:
-            pr_id = get_pr_id(commit.message)
-            message = convert_message(get_message_from_pr(repo, pr_id))
-            if make_link:
-                url = f"https://github.com/packit/{repo}/pull/{pr_id}"
-                pr_id = f"[{repo}#{pr_id}]({url})"
+def post_graphql(session: requests.Session, url: str, query: str, variables: dict):
+    """Run the GraphQL query, wait and retry when the rate limit is hit."""
+    for attempt in range(1, GRAPHQL_MAX_ATTEMPTS + 1):
+        response = session.post(
+            url, json={"query": query, "variables": variables}, timeout=60
+        )
+        # primary rate limit exhausted or secondary rate limit hit
+        if response.status_code in (403, 429) and attempt < GRAPHQL_MAX_ATTEMPTS:
+            if "Retry-After" in response.headers:
+                delay = int(response.headers["Retry-After"])
+            elif response.headers.get("X-RateLimit-Remaining") == "0":
+                delay = int(response.headers["X-RateLimit-Reset"]) - time.time()
             else:
-                pr_id = "#" + pr_id
-            changelog += f"- {message} ({pr_id})\n"
+                delay = 60 * attempt
+            click.echo(f"GitHub rate limit hit, waiting {max(delay, 1):.0f}s", err=True)
+            time.sleep(max(delay, 1))
+            continue
+        response.raise_for_status()
+        data = response.json()
+        if "data" not in data or data["data"] is None:
+            raise RuntimeError(f"GraphQL query failed: {data.get('errors')}")
+        return data["data"]
+
+
+def fetch_pr_descriptions_graphql(
+    repo: str, pr_ids: List[str], url: str = GITHUB_GRAPHQL_URL
+) -> Dict[str, str]:
+    """Fetch descriptions of the pull requests, GRAPHQL_BATCH_SIZE of them by
+    a single query. Pull requests that could not be fetched are missing from
+    the result."""
+    session = requests.Session()
+    if token := os.getenv("GITHUB_TOKEN"):
+        session.headers["Authorization"] = f"bearer {token}"
+
+    numbers = sorted({int(pr_id) for pr_id in pr_ids if pr_id.isdigit()})
+    descriptions = {}
+    for i in range(0, len(numbers), GRAPHQL_BATCH_SIZE):
+        batch = numbers[i : i + GRAPHQL_BATCH_SIZE]
+        # numbers are integers, safe to be put directly into the query
+        pull_requests = " ".join(
+            f"pr{number}: pullRequest(number: {number}) {{ body }}" for number in batch
+        )
+        query = (
+            "query($owner: String!, $name: String!) { "
+            "rateLimit { remaining resetAt } "
+            f"repository(owner: $owner, name: $name) {{ {pull_requests} }} }}"
+        )
+        data = post_graphql(session, url, query, {"owner": "packit", "name": repo})
+
+        for number in batch:
+            if pr := (data["repository"] or {}).get(f"pr{number}"):
+                descriptions[str(number)] = pr["body"]
+
+        rate_limit = data["rateLimit"]
+        if rate_limit["remaining"] < GRAPHQL_MIN_REMAINING:
+            reset_at = datetime.fromisoformat(
+                rate_limit["resetAt"].replace("Z", "+00:00")
+            )
+            delay = (reset_at - datetime.now(timezone.utc)).total_seconds()
+            click.echo(
+                f"GitHub rate limit almost exhausted, waiting {delay:.0f}s", err=True
+            )
+            time.sleep(max(delay, 0))
+
+    return descriptions
+
+
+def fetch_pr_descriptions(
+    repo: str, pr_ids: List[str], graphql_url: str = GITHUB_GRAPHQL_URL
+) -> Dict[str, str]:
+    """Fetch descriptions of the pull requests in batches via GraphQL and
+    fetch the rest concurrently via REST API."""
+    try:
+        descriptions = fetch_pr_descriptions_graphql(repo, pr_ids, graphql_url)
+    except (requests.RequestException, RuntimeError) as ex:
+        click.echo(f"Fetching via GraphQL failed ({ex}), using REST API", err=True)
+        descriptions = {}
+
+    missing = [pr_id for pr_id in pr_ids if pr_id not in descriptions]
+    with ThreadPoolExecutor(max_workers=REST_FALLBACK_WORKERS) as executor:
+        descriptions.update(
+            zip(
+                missing,
+                executor.map(lambda pr_id: get_message_from_pr(repo, pr_id), missing),
+            )
+        )
+    return descriptions
+
+
+def get_pr_descriptions(
+    repo: str,
+    prs: List[Tuple[str, str]],
+    cache: Optional[PRDescriptionCache] = None,
+    batch: bool = False,
+    graphql_url: str = GITHUB_GRAPHQL_URL,
+) -> Dict[str, str]:
+    """Get descriptions of the pull requests given as (PR ID, merge commit SHA)
+    pairs, either from the cache or from GitHub one by one or in batches."""
+    descriptions = {}
+    if cache is not None:
+        for pr_id, sha in prs:
+            if (description := cache.get(repo, pr_id, sha)) is not None:
+                descriptions[pr_id] = description
+
+    missing = list(
+        dict.fromkeys(pr_id for pr_id, _ in prs if pr_id not in descriptions)
+    )
+    if batch:
+        descriptions.update(fetch_pr_descriptions(repo, missing, graphql_url))
+    else:
+        for pr_id in missing:
+            descriptions[pr_id] = get_message_from_pr(repo, pr_id)
+
+    if cache is not None:
+        for pr_id, sha in prs:
+            if pr_id in missing:
+                cache.set(repo, pr_id, sha, descriptions[pr_id])
+    return descriptions
+
+
+def get_changelog(
+    commits: Iterable[Union[Commit, MergeCommit]],
+    repo: str,
+    make_link: bool = False,
+    cache: Optional[PRDescriptionCache] = None,
+    batch: bool = False,
+    graphql_url: str = GITHUB_GRAPHQL_URL,
+) -> str:
+    # collect the pull requests first, so they can be fetched at once
+    prs = []
+    for commit in commits:
+        pr_id, release_note = parse_message(commit.message)
+        if release_note:
+            prs.append((pr_id, commit.hexsha))
+
+    descriptions = get_pr_descriptions(repo, prs, cache, batch, graphql_url)
+
+    changelog = ""
+    for pr_id, _ in prs:
+        message = convert_message(descriptions[pr_id])
+        if make_link:
+            url = f"https://github.com/packit/{repo}/pull/{pr_id}"
+            pr_id = f"[{repo}#{pr_id}]({url})"
+        else:
+            pr_id = "#" + pr_id
+        changelog += f"- {message} ({pr_id})\n"
     return changelog
 
 
@@ -109,6 +425,11 @@ def get_changelog(commits: Iterable[Commit], repo: str, make_link: bool = False)
     Currently, the changelog entry in the message is detected based on
     explicit marks of the beginning and the end denoted by
     `RELEASE NOTES BEGIN` and `RELEASE NOTES END` separators.
+
+    Descriptions of the pull requests are cached in
+    `$XDG_CACHE_HOME/packit-changelog/`, so repeated runs don't need
+    to fetch them again. With --batch, they are fetched via GraphQL API
+    in batches instead of one request per pull request.
     """,
 )
 @click.option(
@@ -118,10 +439,38 @@ def get_changelog(commits: Iterable[Commit], repo: str, make_link: bool = False)
     help="Git repository used for getting the changelog. "
     "Current directory is used by default.",
 )
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help="Use the persistent cache of pull request descriptions.",
+)
+@click.option(
+    "--batch/--no-batch",
+    default=False,
+    show_default=True,
+    help="Fetch pull request descriptions in batches via GraphQL API.",
+)
+@click.option(
+    "--graphql-url",
+    default=GITHUB_GRAPHQL_URL,
+    show_default=True,
+    envvar="GITHUB_GRAPHQL_URL",
+    help="GitHub GraphQL API endpoint used in the batch mode.",
+)
 @click.argument("ref", type=click.STRING, required=False)
-def changelog(git_repo, ref):
+def changelog(git_repo, ref, cache, batch, graphql_url):
     repo = Repo(git_repo)
-    print(get_changelog(get_relevant_commits(repo, ref), Path(repo.working_dir).name))
+    with PRDescriptionCache() if cache else nullcontext() as pr_cache:
+        print(
+            get_changelog(
+                get_relevant_commits(repo, ref),
+                Path(repo.working_dir).name,
+                cache=pr_cache,
+                batch=batch,
+                graphql_url=graphql_url,
+            )
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "pyyaml",
+# ]
+# ///
+
+"""Check that the deployment repo and a vars file are up-to-date.
+
+- The local main branch is compared with the remote one. The remote HEAD
+  is cached for a short time, so deploying several services/deployments
+  in a row asks the remote only once; it's asked again before reporting
+  the branch as out of date.
+- vars/<service>/<deployment>.yml is compared with its _template.yml
+  structurally, keys expected to differ (api_key, host) are ignored and
+  the added, removed and changed keys are reported by their path.
+
+Used by tasks/check-up-to-date.yml, exits with 1 if anything is out of date.
+"""
+
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+
+import click
+import yaml
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+CACHE_PATH = (
+    Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "packit-deployment"
+    / "remote-heads.json"
+)
+REMOTE_HEAD_TTL = 300
+IGNORED_KEYS = ("api_key", "host")
+
+
+def git(*args: str) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=PROJECT_DIR, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except subprocess.CalledProcessError as ex:
+        raise click.ClickException(
+            f"'git {' '.join(args)}' failed: {ex.stderr.strip()}"
+        ) from ex
+
+
+def get_remote_head(url: str, branch: str, ttl: int) -> str:
+    """Commit of the branch in the remote repo, cached for ttl seconds."""
+    key = f"{url} {branch}"
+    try:
+        cache = json.loads(CACHE_PATH.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    entry = cache.get(key)
+    if entry and time.time() - entry["fetched_at"] < ttl:
+        return entry["commit"]
+
+    output = git("ls-remote", url, f"refs/heads/{branch}")
+    if not output:
+        raise click.ClickException(f"Branch {branch} not found in {url}")
+    commit = output.split()[0]
+    cache[key] = {"commit": commit, "fetched_at": time.time()}
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(cache, indent=2))
+    tmp.replace(CACHE_PATH)
+    return commit
+
+
+def check_repo(url: str, branch: str, ttl: int) -> Optional[str]:
+    local = git("rev-parse", f"refs/heads/{branch}")
+    remote = get_remote_head(url, branch, ttl)
+    if local != remote and ttl:
+        # the cached one may be older than the local branch, e.g. just pulled
+        remote = get_remote_head(url, branch, 0)
+    if local != remote:
+        return (
+            f"The {branch} branch of the deployment repo is not up-to-date"
+            f" (local {local[:12]}, {url} {remote[:12]})"
+        )
+    return None
+
+
+def format_path(path: Tuple[Any, ...]) -> str:
+    return "".join(
+        f"[{key}]" if isinstance(key, int) else f".{key}" for key in path
+    ).lstrip(".")
+
+
+def compare(
+    current: Any, template: Any, ignored: Tuple[str, ...], path: Tuple[Any, ...] = ()
+) -> Iterator[Tuple[str, str]]:
+    """Yields (change, path) of the differences of the current value."""
+    if isinstance(current, dict) and isinstance(template, dict):
+        for key in current.keys() | template.keys():
+            if key in ignored:
+                continue
+            if key not in template:
+                yield "added", format_path(path + (key,))
+            elif key not in current:
+                yield "removed", format_path(path + (key,))
+            else:
+                yield from compare(current[key], template[key], ignored, path + (key,))
+    elif (
+        isinstance(current, list)
+        and isinstance(template, list)
+        and len(current) == len(template)
+    ):
+        for index, (item, template_item) in enumerate(zip(current, template)):
+            yield from compare(item, template_item, ignored, path + (index,))
+    elif current != template:
+        yield "changed", format_path(path)
+
+
+def check_vars(service: str, deployment: str, ignored: Tuple[str, ...]) -> List[str]:
+    vars_dir = PROJECT_DIR / "vars" / service
+    current_path = vars_dir / f"{deployment}.yml"
+    template_path = vars_dir / f"{deployment}_template.yml"
+    current = yaml.safe_load(current_path.read_text()) or {}
+    template = yaml.safe_load(template_path.read_text()) or {}
+    return [
+        f"{change} {path}"
+        for change, path in sorted(
+            compare(current, template, ignored), key=lambda change: change[1]
+        )
+    ]
+
+
+@click.command()
+@click.option("--service", envvar="SERVICE", default="packit", show_default=True)
+@click.option("--deployment", envvar="DEPLOYMENT", required=True)
+@click.option(
+    "--repo-url",
+    default="https://github.com/packit/deployment.git",
+    show_default=True,
+)
+@click.option("--branch", default="main", show_default=True)
+@click.option(
+    "--remote-head-ttl",
+    default=REMOTE_HEAD_TTL,
+    show_default=True,
+    help="Seconds to reuse the remote HEAD for, 0 to always ask the remote.",
+)
+@click.option(
+    "--repo/--no-repo",
+    "with_repo",
+    default=True,
+    show_default=True,
+    help="Check the deployment repo.",
+)
+@click.option(
+    "--vars/--no-vars",
+    "with_vars",
+    default=True,
+    show_default=True,
+    help="Compare the vars file with its template.",
+)
+@click.option(
+    "--ignore-key",
+    "ignored",
+    multiple=True,
+    default=IGNORED_KEYS,
+    show_default=True,
+    help="Key expected to differ from the template, repeatable.",
+)
+def main(
+    service,
+    deployment,
+    repo_url,
+    branch,
+    remote_head_ttl,
+    with_repo,
+    with_vars,
+    ignored,
+):
+    """Check that the deployment repo and the vars file are up-to-date."""
+    problems = []
+    if with_repo:
+        if problem := check_repo(repo_url, branch, remote_head_ttl):
+            problems.append(problem)
+    if with_vars:
+        if differences := check_vars(service, deployment, tuple(ignored)):
+            problems.append(
+                f"'vars/{service}/{deployment}.yml' differs from"
+                f" 'vars/{service}/{deployment}_template.yml':\n  "
+                + "\n  ".join(differences)
+            )
+    if problems:
+        raise click.ClickException("\n".join(problems))
+    click.echo("Up-to-date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+# ]
+# ///
+
+"""Compare two deploy profiles written by the deploy_profile callback
+(callback_plugins/deploy_profile.py, 'make profile-deploy') and report
+regressions.
+
+Durations of the whole deploy, of the phases (task files), of the components
+and of the tasks are compared, as well as the number of API calls. Exits
+with 1 if anything got slower by more than the threshold.
+"""
+
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+import click
+
+
+class Change(NamedTuple):
+    section: str
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def delta(self) -> float:
+        return self.current - self.baseline
+
+    @property
+    def ratio(self) -> float:
+        return self.delta / self.baseline if self.baseline else float("inf")
+
+
+def load(path: Path) -> dict:
+    return json.loads(path.read_text())
+
+
+def task_durations(profile: dict) -> Dict[str, float]:
+    """Sum of durations per task, included tasks run once per loop item."""
+    durations: Dict[str, float] = defaultdict(float)
+    for task in profile["tasks"]:
+        durations[f"{task['path']} {task['name']}"] += task["duration"]
+    return durations
+
+
+def compare(baseline: dict, current: dict) -> List[Change]:
+    changes = [
+        Change("total", "duration", baseline["duration"], current["duration"]),
+        Change("total", "api calls", baseline["api_calls"], current["api_calls"]),
+    ]
+    sections = {
+        "phase": lambda profile: {
+            name: phase["duration"] for name, phase in profile["phases"].items()
+        },
+        "component": lambda profile: {
+            name: component["duration"]
+            for name, component in profile["components"].items()
+        },
+        "task": task_durations,
+    }
+    for section, get_durations in sections.items():
+        old, new = get_durations(baseline), get_durations(current)
+        changes.extend(
+            Change(section, name, old.get(name, 0.0), new.get(name, 0.0))
+            for name in sorted(old.keys() | new.keys())
+        )
+    return changes
+
+
+def is_regression(change: Change, threshold: float, min_seconds: float) -> bool:
+    if change.name == "api calls":
+        return change.delta > 0
+    return change.delta > min_seconds and change.ratio > threshold
+
+
+@click.command()
+@click.argument("baseline", type=click.Path(exists=True, path_type=Path))
+@click.argument("current", type=click.Path(exists=True, path_type=Path))
+@click.option(
+    "--threshold",
+    default=10.0,
+    show_default=True,
+    help="Slowdown in percent considered a regression.",
+)
+@click.option(
+    "--min-seconds",
+    default=1.0,
+    show_default=True,
+    help="Ignore slowdowns shorter than this, timing of short tasks is noisy.",
+)
+@click.option(
+    "--all",
+    "show_all",
+    is_flag=True,
+    help="Show all the changes, not only regressions.",
+)
+def main(baseline, current, threshold, min_seconds, show_all):
+    """Compare deploy profiles BASELINE and CURRENT."""
+    changes = compare(load(baseline), load(current))
+    regressions = [
+        change
+        for change in changes
+        if is_regression(change, threshold / 100, min_seconds)
+    ]
+
+    for change in changes if show_all else regressions:
+        mark = "!" if change in regressions else " "
+        click.echo(
+            f"{mark} {change.section:<9} {change.baseline:9.1f} → {change.current:9.1f}"
+            f" {change.delta:+9.1f} ({change.ratio:+7.1%})  {change.name}"
+        )
+
+    if regressions:
+        raise click.ClickException(
+            f"{len(regressions)} regressions (slower by more than {threshold}%"
+            f" and {min_seconds}s, or more API calls)"
+        )
+    click.echo(
+        f"No regressions, total {changes[0].baseline:.1f}s → {changes[0].current:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,10 @@ set -eu
 
 # Script to
 # - login to Bitwarden and/or unlock the vault
-# - download all files attached to
+# - download files attached to
 #   secrets-${SERVICE}-${DEPLOYMENT} and secrets-tls-certs notes
-#   into secrets/${SERVICE}/${DEPLOYMENT}/
+#   into secrets/${SERVICE}/${DEPLOYMENT}/, only the new or changed ones
+#   (see scripts/sync_secrets.py)
 # Example usage:
 # SERVICE=packit DEPLOYMENT=stg PATH_TO_SECRETS=/tmp/xyz/ ./scripts/download_secrets.sh
 
@@ -44,20 +45,7 @@ fi
 [ -n "$BW_SESSION" ] || { echo >&2 "Bitwarden session (BW_SESSION) is not set"; exit 1; }
 export BW_SESSION
 
-# Pull the latest vault data from server
-bw sync --force
-
-download_attachments_of_item() {
-  # Parameter is the name of the shared (Bitwarden vault) item,
-  # which contains the secret files as attachments.
-
-  # Get the item id first
-  ITEM_ID=$(bw get item "${1}" | jq -r .id)
-  [[ -z ${ITEM_ID} ]] && { echo >&2 "Couldn't find ${1} in Bitwarden vault"; exit 1; }
-
-  # Download all attachments of that item
-  bw get item "${1}" | jq -r .attachments[].id | xargs -L1 bw get attachment --itemid "${ITEM_ID}" --output "${PATH_TO_SECRETS}"
-}
-
-download_attachments_of_item "secrets-${SERVICE}-${DEPLOYMENT}"
-download_attachments_of_item "secrets-tls-certs"
+# Pull the latest vault data from server and download the new or changed attachments,
+# set BW_FORCE_SYNC to any value to pull the whole vault.
+"$(dirname "$0")/sync_secrets.py" ${BW_FORCE_SYNC:+--force-sync} --output "${PATH_TO_SECRETS}" \
+  "secrets-${SERVICE}-${DEPLOYMENT}" "secrets-tls-certs"
@@ -5,72 +5,226 @@
 
 # /// script
 # dependencies = [
-#   "ruamel.yaml",
+#   "ijson",
 #   "requests",
 # ]
 # ///
 
 import argparse
-import copy
+import json
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
 
+import ijson
 import requests
-import ruamel.yaml
 from pathlib import Path
 
 # Constants
 SCRIPTS_DIR = Path(__file__).parent
 ROOT_DIR = SCRIPTS_DIR.parent
-packit_service_file = ROOT_DIR / "secrets/packit/prod/packit-service.yaml.j2"
-SKIP_JINJA_LINES = 32
+# production runs Fedora CI for all the projects (opt-out mode)
+packit_service_file = ROOT_DIR / "secrets/packit/stg/packit-service.yaml.j2"
+# The templates contain Jinja syntax, so they can't be loaded as YAML,
+# the list of projects is found by the path of keys leading to it instead.
+FEDORA_CI_PROJECTS_PATHS = [
+    ("enabled_projects_for_fedora_ci",),
+    ("fedora_ci", "enabled_projects"),
+]
+# item of a block sequence: indentation and the value (without a comment)
+ITEM_RE = re.compile(r"^(\s*)- +(\S+)\s*(#.*)?$")
 DIST_GIT_FORMAT = r"https://src.fedoraproject.org/rpms/{}"
 PAGURE_BZ = "https://src.fedoraproject.org/extras/pagure_bz.json"
-
-parser = argparse.ArgumentParser(
-    description="Provide a comma-separated list of FAS maintainers/groups to bulk add to the packit-service.yaml.j2.",
-)
-parser.add_argument(
-    "maintainers",
-    type=str,
-    nargs="+",
-    help="a comma-separated list of FAS maintainers",
+# maintainer → packages index built from PAGURE_BZ, refreshed only when changed
+CACHE_DIR = (
+    Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "packit-enroll-users"
 )
-args = parser.parse_args()
-maintainers = {maintainer.strip() for maintainer in args.maintainers[0].split(",")}
-print(f"Onboarding packages for {maintainers}")
-
-# Using ruamel.yaml to preserve comments and format
-packit_service_yaml = ruamel.yaml.YAML()
-packit_service_yaml.indent(mapping=2, sequence=4, offset=2)
-
-# Get the current packit-service.yaml.j2 file
-with packit_service_file.open("r") as f:
-    jinja_lines = []
-    for _ in range(SKIP_JINJA_LINES):
-        jinja_lines.append(next(f))
-    packit_service = packit_service_yaml.load(f.read())
-
-# Get all active
-response = requests.get(PAGURE_BZ)
-maintainers_data = response.json()
-maintainers_projects = {
-    pkg_name
-    for pkg_name, pkg_maintainers in maintainers_data["rpms"].items()
-    if any(m in maintainers for m in pkg_maintainers)
-}
-
-# Onboard user's projects
-fedora_ci_projects = copy.copy(packit_service["enabled_projects_for_fedora_ci"])
-previous_count = len(fedora_ci_projects)
-for project in maintainers_projects:
-    dist_git_url = DIST_GIT_FORMAT.format(project)
-    if dist_git_url not in fedora_ci_projects:
-        fedora_ci_projects.append(dist_git_url)
-new_count = len(fedora_ci_projects)
-
-# Update the packit-service.yaml.j2 file
-print(f"Number of projects added: {new_count - previous_count}")
-packit_service["enabled_projects_for_fedora_ci"] = sorted(fedora_ci_projects)
-with packit_service_file.open("w") as f:
-    for line in jinja_lines:
-        f.write(line)
-    packit_service_yaml.dump(packit_service, f)
+PAGURE_BZ_INDEX = CACHE_DIR / "pagure_bz_index.json"
+
+
+def build_maintainers_index(stream: BinaryIO) -> Dict[str, List[str]]:
+    """Build the maintainer → packages index from the pagure_bz.json stream
+    without loading the whole document into memory."""
+    index = defaultdict(list)
+    for pkg_name, pkg_maintainers in ijson.kvitems(stream, "rpms"):
+        for maintainer in pkg_maintainers:
+            index[maintainer].append(pkg_name)
+    return index
+
+
+def get_maintainers_index() -> Dict[str, List[str]]:
+    """Get the maintainer → packages index, download and rebuild it only
+    if pagure_bz.json has changed since the last run."""
+    try:
+        with PAGURE_BZ_INDEX.open() as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = None
+
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with requests.get(PAGURE_BZ, headers=headers, stream=True, timeout=60) as response:
+        if cached and response.status_code == requests.codes.not_modified:
+            print("Using cached maintainers index, pagure_bz.json has not changed")
+            return cached["index"]
+        response.raise_for_status()
+        response.raw.decode_content = True
+        index = build_maintainers_index(response.raw)
+
+    PAGURE_BZ_INDEX.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = PAGURE_BZ_INDEX.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "index": index,
+            },
+            f,
+        )
+    tmp_path.replace(PAGURE_BZ_INDEX)
+    return index
+
+
+def get_maintainers_projects(
+    index: Dict[str, List[str]], maintainers: Set[str]
+) -> Set[str]:
+    return {
+        pkg_name for maintainer in maintainers for pkg_name in index.get(maintainer, [])
+    }
+
+
+def find_projects_list(
+    lines: List[str], path: Tuple[str, ...]
+) -> Optional[Tuple[slice, str]]:
+    """Find the lines with items of the list under the path of keys.
+
+    Returns the slice of the item lines and their indentation. An empty
+    inline list (`key: []`) is turned into a block one in place.
+    """
+    i, parent_indent, match = 0, -1, None
+    for depth, key in enumerate(path):
+        key_re = re.compile(rf"^(\s*){re.escape(key)}:\s*(\[\s*\])?\s*(#.*)?$")
+        while i < len(lines):
+            line = lines[i]
+            i += 1
+            if not line.strip() or line.lstrip().startswith(("#", "{%", "{#")):
+                continue
+            indent = len(line) - len(line.lstrip())
+            if indent <= parent_indent:
+                # left the parent mapping
+                return None
+            if (match := key_re.match(line)) and (depth > 0 or indent == 0):
+                parent_indent = indent
+                break
+        else:
+            return None
+
+    if match.group(2):
+        lines[i - 1] = f"{match.group(1)}{path[-1]}:\n"
+
+    end = i
+    while end < len(lines) and ITEM_RE.match(lines[end]):
+        end += 1
+    if end > i:
+        item_indent = ITEM_RE.match(lines[i]).group(1)
+    else:
+        item_indent = " " * (parent_indent + 2)
+    return slice(i, end), item_indent
+
+
+def enroll_projects(target: Path, projects: Set[str]) -> int:
+    """Add the dist-git projects to the target packit-service.yaml.j2 file.
+
+    Only the list of the enabled projects is edited, the rest of the file
+    (including any Jinja syntax) is kept untouched. The file is written only
+    if the list changes. Returns the number of added projects.
+    """
+    lines = target.read_text().splitlines(keepends=True)
+    for path in FEDORA_CI_PROJECTS_PATHS:
+        if found := find_projects_list(lines, path):
+            items, item_indent = found
+            break
+    else:
+        raise ValueError(f"{target}: no list of projects enabled for Fedora CI")
+
+    current_projects = [
+        ITEM_RE.match(line).group(2).strip("'\"") for line in lines[items]
+    ]
+    fedora_ci_projects = set(current_projects)
+    previous_count = len(fedora_ci_projects)
+    fedora_ci_projects.update(DIST_GIT_FORMAT.format(project) for project in projects)
+    new_projects = sorted(fedora_ci_projects)
+
+    if new_projects == sorted(current_projects):
+        return 0
+
+    lines[items] = [f"{item_indent}- {project}\n" for project in new_projects]
+    target.write_text("".join(lines))
+    return len(fedora_ci_projects) - previous_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Bulk add packages of FAS maintainers/groups to packit-service.yaml.j2 files.",
+        epilog="Example: enroll-users.py --target secrets/packit/prod/packit-service.yaml.j2 "
+        "--target secrets/packit/stg/packit-service.yaml.j2 user1,user2 @group",
+    )
+    parser.add_argument(
+        "maintainers",
+        type=str,
+        nargs="+",
+        help="comma-separated lists of FAS maintainers/groups",
+    )
+    parser.add_argument(
+        "--target",
+        dest="targets",
+        type=Path,
+        action="append",
+        help="packit-service.yaml.j2 file to update, can be given multiple times "
+        f"(default: {packit_service_file.relative_to(ROOT_DIR)})",
+    )
+    args = parser.parse_args()
+    maintainer_sets = [
+        {
+            maintainer.strip()
+            for maintainer in maintainers.split(",")
+            if maintainer.strip()
+        }
+        for maintainers in args.maintainers
+    ]
+    targets = args.targets or [packit_service_file]
+
+    # Get the projects of all the maintainers once for all the targets
+    index = get_maintainers_index()
+    maintainers_projects = set()
+    for maintainers in maintainer_sets:
+        projects = get_maintainers_projects(index, maintainers)
+        print(f"Onboarding {len(projects)} packages for {maintainers}")
+        maintainers_projects |= projects
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [
+            executor.submit(enroll_projects, target, maintainers_projects)
+            for target in targets
+        ]
+        for target, future in zip(targets, futures):
+            try:
+                count = future.result()
+            except ValueError as ex:
+                print(f"Skipping {ex}")
+                continue
+            print(
+                f"{target}: number of projects added: {count}"
+                + ("" if count else " (not changed)")
+            )
+
+
+if __name__ == "__main__":
+    main()
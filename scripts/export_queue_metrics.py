@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "redis",
+# ]
+# ///
+
+"""Export depth and age of the Celery queues to the Prometheus pushgateway.
+
+Every interval the length, the newest and the oldest message of every queue
+and the size and the oldest entry of the unacked messages (taken by workers,
+not acknowledged yet) are read by a single pipeline and pushed as gauges.
+
+Celery messages don't carry the time they were sent, so the age of the oldest
+message is sampled: messages are pushed to the head of a queue and taken from
+its tail, the newest message is remembered with the time it was first seen
+and once it reaches the tail, its age is known (up to the interval). Messages
+already queued when the exporter started are aged from the time they were
+first seen.
+
+Deployed as the queue-exporter component (with_queue_exporter), to try it out:
+
+    $ export_queue_metrics.py --namespace packit--stg --once
+"""
+
+import hashlib
+import json
+import time
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+import click
+import redis
+
+import kv_database
+
+JOB = "celery_queues"
+# kombu keeps the unacked messages in a hash and their delivery times in a zset
+UNACKED = "unacked"
+UNACKED_INDEX = "unacked_index"
+INTERVAL = 15
+
+Metric = Tuple[str, str, Dict[str, str], float]
+
+
+def message_id(message: bytes) -> str:
+    try:
+        return json.loads(message)["properties"]["delivery_tag"]
+    except (ValueError, KeyError, TypeError):
+        return hashlib.sha256(message).hexdigest()
+
+
+class QueueSampler:
+    def __init__(self, queues: List[str]) -> None:
+        self.queues = queues
+        # queue → message ID → time the message was first seen
+        self.first_seen: Dict[str, Dict[str, float]] = {queue: {} for queue in queues}
+
+    def age_of_oldest(
+        self, queue: str, newest: Optional[bytes], oldest: Optional[bytes], now: float
+    ) -> float:
+        seen = self.first_seen[queue]
+        if newest is None or oldest is None:
+            seen.clear()
+            return 0.0
+        newest_id, oldest_id = message_id(newest), message_id(oldest)
+        seen.setdefault(newest_id, now)
+        oldest_seen = seen.setdefault(oldest_id, now)
+        # the messages seen before the oldest one have been consumed
+        for seen_id, first_seen in list(seen.items()):
+            if first_seen < oldest_seen:
+                del seen[seen_id]
+        return now - oldest_seen
+
+    def sample(self, client: redis.Redis) -> List[Metric]:
+        # MULTI/EXEC, the length and both ends are read from the same queue
+        pipeline = client.pipeline(transaction=True)
+        for queue in self.queues:
+            pipeline.llen(queue)
+            pipeline.lindex(queue, 0)
+            pipeline.lindex(queue, -1)
+        pipeline.hlen(UNACKED)
+        pipeline.zrange(UNACKED_INDEX, 0, 0, withscores=True)
+        start = time.monotonic()
+        *queues, unacked, oldest_unacked = pipeline.execute()
+        duration = time.monotonic() - start
+        now = time.time()
+
+        metrics: List[Metric] = []
+        for index, queue in enumerate(self.queues):
+            length, newest, oldest = queues[3 * index : 3 * index + 3]
+            labels = {"queue": queue}
+            metrics.append(
+                ("celery_queue_length", "Messages waiting in the queue", labels, length)
+            )
+            metrics.append(
+                (
+                    "celery_queue_oldest_message_age_seconds",
+                    "Time the oldest message of the queue has been waiting for",
+                    labels,
+                    self.age_of_oldest(queue, newest, oldest, now),
+                )
+            )
+        metrics.append(
+            (
+                "celery_unacked_messages",
+                "Messages taken by workers, not acknowledged yet",
+                {},
+                unacked,
+            )
+        )
+        metrics.append(
+            (
+                "celery_unacked_oldest_age_seconds",
+                "Time since the oldest unacknowledged message was taken by a worker",
+                {},
+                now - oldest_unacked[0][1] if oldest_unacked else 0.0,
+            )
+        )
+        metrics.append(
+            (
+                "celery_queue_exporter_poll_seconds",
+                "Round trip of the pipeline reading the queues",
+                {},
+                duration,
+            )
+        )
+        return metrics
+
+
+def format_metrics(metrics: List[Metric]) -> str:
+    """Prometheus text format."""
+    lines = []
+    described = set()
+    for name, description, labels, value in metrics:
+        if name not in described:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            described.add(name)
+        label_string = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        lines.append(
+            f"{name}{{{label_string}}} {value:g}" if labels else f"{name} {value:g}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def push(pushgateway: str, job: str, metrics: str) -> None:
+    """Replace the metrics of the job in the pushgateway."""
+    request = urllib.request.Request(
+        f"{pushgateway.rstrip('/')}/metrics/job/{job}",
+        data=metrics.encode(),
+        method="PUT",
+        headers={"Content-Type": "text/plain; version=0.0.4"},
+    )
+    with urllib.request.urlopen(request, timeout=10):
+        pass
+
+
+@click.command()
+@kv_database.connection_options
+@click.option(
+    "--pushgateway",
+    envvar="PUSHGATEWAY_ADDRESS",
+    help="Address of the pushgateway, the metrics are printed if not set.",
+)
+@click.option("--job", default=JOB, show_default=True, help="Job label of the metrics.")
+@click.option(
+    "--interval",
+    default=INTERVAL,
+    show_default=True,
+    help="Seconds between the samples.",
+)
+@click.option("--once", is_flag=True, help="Take a single sample and exit.")
+def main(namespace, component, host, port, db, pushgateway, job, interval, once):
+    """Push depth and age of the Celery queues to the pushgateway."""
+    sampler = QueueSampler(kv_database.QUEUES)
+    with kv_database.connect(namespace, component, host, port, db) as client:
+        while True:
+            start = time.monotonic()
+            try:
+                metrics = format_metrics(sampler.sample(client))
+                if pushgateway:
+                    push(pushgateway, job, metrics)
+                else:
+                    click.echo(metrics)
+            except (redis.RedisError, OSError) as ex:
+                if once:
+                    raise click.ClickException(str(ex)) from ex
+                # keep going, the database or the pushgateway may be restarting
+                click.echo(f"Failed to export the metrics: {ex}", err=True)
+            if once:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+# ]
+# ///
+
+"""Fill the repository cache of sandcastle with clones of the most-used repositories.
+
+The workers clone repositories in sandcastle with '--reference' to
+/repository-cache/<repository name> (repository_cache in packit-service.yaml),
+so objects already in the cache are neither downloaded nor stored again.
+
+- The repositories are kept as bare clones of the branches and tags, without
+  a working tree. Partial clones can't be used, a clone referencing a partial
+  clone would miss the objects which were not fetched into it.
+- Only the repositories whose branches or tags changed since the last run
+  (compared by 'git ls-remote') are fetched, in parallel.
+- When the cache is over its size limit, the least-used repositories are
+  evicted: the ones no longer listed first (those not listed for the longest
+  time first), then the listed ones from the end of the list.
+
+The state is kept in a manifest file in the cache directory.
+
+    $ fill_repository_cache.py --cache-dir /repository-cache --max-size 3.5Gi repositories.txt
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import click
+
+MANIFEST_NAME = ".repository-cache.json"
+WORKERS = 4
+REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+SIZE_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMGT]i?)?B?$")
+SIZE_UNITS = {
+    None: 1,
+    "K": 10**3,
+    "M": 10**6,
+    "G": 10**9,
+    "T": 10**12,
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+}
+
+
+class Repository(NamedTuple):
+    name: str
+    url: str
+    # position in the list, the most-used ones first
+    rank: int
+
+
+def parse_size(ctx, param, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    match = SIZE_RE.match(value.strip())
+    if not match:
+        raise click.BadParameter("use a size like 4Gi or 500M")
+    return int(float(match[1]) * SIZE_UNITS[match[2]])
+
+
+def format_size(size: int) -> str:
+    return f"{size / 2**20:.1f} MiB"
+
+
+def repository_name(url: str) -> str:
+    """The name packit looks the repository up by in the cache."""
+    return url.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")
+
+
+def read_repositories(lines: List[str]) -> List[Repository]:
+    """One URL per line, the most-used repositories first, '#' starts a comment."""
+    repositories: Dict[str, Repository] = {}
+    for line in lines:
+        url = line.split("#", 1)[0].strip()
+        if not url:
+            continue
+        name = repository_name(url)
+        if name in repositories:
+            raise click.ClickException(
+                f"{url} and {repositories[name].url} would be cached both as {name}"
+            )
+        repositories[name] = Repository(name, url, len(repositories))
+    return list(repositories.values())
+
+
+def git(*args: str, cwd: Optional[Path] = None) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            check=True,
+            capture_output=True,
+            text=True,
+            # never wait for credentials
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        ).stdout
+    except subprocess.CalledProcessError as ex:
+        raise click.ClickException(
+            f"'git {' '.join(args[:2])}' failed: {ex.stderr.strip()}"
+        ) from ex
+
+
+def remote_refs(url: str) -> str:
+    """Digest of the branches and tags of the remote repository."""
+    refs = git("ls-remote", "--heads", "--tags", url)
+    return hashlib.sha256(refs.encode()).hexdigest()
+
+
+def directory_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+class Cache:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.manifest_path = directory / MANIFEST_NAME
+        try:
+            self.entries: Dict[str, Dict] = json.loads(self.manifest_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+        self.entries = {
+            name: entry
+            for name, entry in self.entries.items()
+            if (directory / name).is_dir()
+        }
+        # repositories put into the cache by other means (e.g. by hand)
+        for path in directory.iterdir():
+            if path.is_dir() and not path.name.startswith("."):
+                self.entries.setdefault(
+                    path.name, {"url": None, "size": directory_size(path)}
+                )
+
+    def save(self) -> None:
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=2, sort_keys=True))
+        tmp.replace(self.manifest_path)
+
+    def size(self) -> int:
+        return sum(entry.get("size", 0) for entry in self.entries.values())
+
+    def update(self, repository: Repository) -> str:
+        """Clone or fetch the repository if it changed, returns what was done."""
+        entry = self.entries.get(repository.name, {})
+        path = self.directory / repository.name
+        refs = remote_refs(repository.url)
+        if path.is_dir() and entry.get("url") == repository.url:
+            if entry.get("refs") == refs:
+                return "up to date"
+            git("fetch", "--prune", "--quiet", "origin", *REFSPECS, cwd=path)
+            action = "fetched"
+        else:
+            # clone next to it first, the workers may be using the current one
+            tmp = self.directory / f".clone-{repository.name}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            try:
+                git("clone", "--bare", "--quiet", repository.url, str(tmp))
+                git("config", "remote.origin.fetch", REFSPECS[0], cwd=tmp)
+                git("config", "--add", "remote.origin.fetch", REFSPECS[1], cwd=tmp)
+                shutil.rmtree(path, ignore_errors=True)
+                tmp.rename(path)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            action = "cloned"
+        git("gc", "--auto", "--quiet", cwd=path)
+        self.entries[repository.name] = {
+            "url": repository.url,
+            "refs": refs,
+            "updated_at": time.time(),
+            "size": directory_size(path),
+        }
+        return action
+
+    def evict(
+        self, repositories: List[Repository], max_size: int, keep_listed: bool = False
+    ) -> List[str]:
+        """Remove the least-used repositories until the cache fits into max_size."""
+        ranks = {repository.name: repository.rank for repository in repositories}
+        candidates = sorted(
+            (name for name in self.entries if not (keep_listed and name in ranks)),
+            key=lambda name: (
+                name in ranks,
+                # not listed: the longest ago listed first
+                (
+                    -ranks[name]
+                    if name in ranks
+                    else self.entries[name].get("listed_at", 0)
+                ),
+            ),
+        )
+        evicted = []
+        for name in candidates:
+            if self.size() <= max_size:
+                break
+            shutil.rmtree(self.directory / name, ignore_errors=True)
+            del self.entries[name]
+            evicted.append(name)
+        return evicted
+
+
+@click.command()
+@click.argument("repositories", type=click.File())
+@click.option(
+    "--cache-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default="/repository-cache",
+    show_default=True,
+    help="The mounted repository cache PVC.",
+)
+@click.option(
+    "--max-size",
+    callback=parse_size,
+    help="Size limit of the cache, e.g. 3.5Gi, 90% of the filesystem by default.",
+)
+@click.option(
+    "--workers",
+    default=WORKERS,
+    show_default=True,
+    help="Number of repositories cloned/fetched in parallel.",
+)
+def main(repositories, cache_dir, max_size, workers):
+    """Clone or update the REPOSITORIES (a file with one URL per line) in the cache."""
+    repositories = read_repositories(repositories.readlines())
+    if max_size is None:
+        max_size = int(shutil.disk_usage(cache_dir).total * 0.9)
+    cache = Cache(cache_dir)
+
+    # make room for the listed repositories first
+    for name in cache.evict(repositories, max_size, keep_listed=True):
+        click.echo(f"{name}: evicted")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            repository: executor.submit(cache.update, repository)
+            for repository in repositories
+        }
+        for repository, future in futures.items():
+            try:
+                click.echo(f"{repository.name}: {future.result()}")
+            except click.ClickException as ex:
+                failed.append(f"{repository.name}: {ex.message}")
+            if repository.name in cache.entries:
+                cache.entries[repository.name]["listed_at"] = time.time()
+
+    for name in cache.evict(repositories, max_size):
+        click.echo(f"{name}: evicted")
+    cache.save()
+    click.echo(
+        f"{len(cache.entries)} repositories in {cache_dir},"
+        f" {format_size(cache.size())} of {format_size(max_size)}"
+    )
+    if failed:
+        raise click.ClickException("Failed to update\n" + "\n".join(failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,182 @@
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
 
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import json
+import re
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator, Optional, TextIO, Tuple
+from urllib.parse import parse_qs, urlparse
+
 import click
-import jwt
 import yaml
 
 
+def b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class TokenMinter:
+    """Signs webhook tokens (HS256 JWTs) with the HMAC key prepared once.
+
+    The tokens are the same as the ones created by jwt.encode().
+    """
+
+    HEADER = b64url(b'{"alg":"HS256","typ":"JWT"}')
+
+    def __init__(self, secret: str) -> None:
+        self._hmac = hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+    def mint(self, namespace: str, repo_name: Optional[str] = None) -> str:
+        payload = {"namespace": namespace}
+        if repo_name:
+            payload["repo_name"] = repo_name
+        signing_input = (
+            self.HEADER
+            + b"."
+            + b64url(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        )
+        # copy of the keyed state, no need to process the key again
+        signature = self._hmac.copy()
+        signature.update(signing_input)
+        return (signing_input + b"." + b64url(signature.digest())).decode("ascii")
+
+
+def read_token_secret(service_config: str) -> str:
+    with open(service_config, "r") as fp:
+        data = yaml.safe_load(fp)
+    return data["gitlab_token_secret"]
+
+
+def read_repositories(lines: Iterable[str]) -> Iterator[Tuple[str, Optional[str]]]:
+    """Read 'NAMESPACE [REPO_NAME]' pairs, separated by a comma or whitespace."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        namespace, *repo_name = re.split(r"[,\s]+", line, maxsplit=1)
+        yield namespace, repo_name[0] if repo_name else None
+
+
+def write_tokens(
+    minter: TokenMinter,
+    repositories: Iterable[Tuple[str, Optional[str]]],
+    output: TextIO,
+    output_format: str,
+) -> None:
+    writer = csv.writer(output) if output_format == "csv" else None
+    if writer:
+        writer.writerow(["namespace", "repo_name", "token"])
+    for namespace, repo_name in repositories:
+        token = minter.mint(namespace, repo_name)
+        if writer:
+            writer.writerow([namespace, repo_name or "", token])
+        else:
+            output.write(
+                json.dumps(
+                    {"namespace": namespace, "repo_name": repo_name, "token": token}
+                )
+                + "\n"
+            )
+
+
+def serve_tokens(minter: TokenMinter, address: str) -> None:
+    class TokenHandler(BaseHTTPRequestHandler):
+        def send_tokens(self, body: str, content_type: str) -> None:
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            # GET /?namespace=NAMESPACE&repo_name=REPO_NAME
+            query = parse_qs(urlparse(self.path).query)
+            if "namespace" not in query:
+                self.send_error(400, "Missing namespace")
+                return
+            namespace, repo_name = query["namespace"][0], query.get("repo_name")
+            token = minter.mint(namespace, repo_name[0] if repo_name else None)
+            self.send_tokens(json.dumps({"token": token}), "application/json")
+
+        def do_POST(self) -> None:
+            # POST / with 'NAMESPACE [REPO_NAME]' lines, JSON lines returned
+            length = int(self.headers.get("Content-Length", 0))
+            lines = self.rfile.read(length).decode("utf-8").splitlines()
+            output = io.StringIO()
+            write_tokens(minter, read_repositories(lines), output, "jsonl")
+            self.send_tokens(output.getvalue(), "application/jsonl")
+
+    host, _, port = address.rpartition(":")
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), TokenHandler)
+    click.echo(f"Minting tokens on http://{host or '127.0.0.1'}:{port}/", err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def run_benchmark(secret: str, count: int) -> None:
+    import jwt
+
+    minter = TokenMinter(secret)
+    for name, mint in [
+        (
+            "jwt.encode",
+            lambda i: jwt.encode(
+                {"namespace": "packit", "repo_name": f"repo-{i}"},
+                secret,
+                algorithm="HS256",
+            ),
+        ),
+        ("TokenMinter", lambda i: minter.mint("packit", f"repo-{i}")),
+    ]:
+        start = time.perf_counter()
+        for i in range(count):
+            mint(i)
+        per_token = (time.perf_counter() - start) / count
+        click.echo(f"{name:>12}: {per_token * 1e6:.1f} µs per token")
+
+
 @click.command()
 @click.argument("service_config")
-@click.argument("namespace")
+@click.argument("namespace", required=False)
 @click.argument("repo_name", required=False)
-def generate_webhook(service_config, namespace, repo_name):
+@click.option(
+    "--bulk",
+    type=click.File("r"),
+    help="File with 'NAMESPACE [REPO_NAME]' lines to generate tokens for, "
+    "'-' for stdin.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["jsonl", "csv"]),
+    default="jsonl",
+    show_default=True,
+    help="Output format of the bulk mode.",
+)
+@click.option(
+    "--serve",
+    metavar="[HOST:]PORT",
+    help="Serve tokens over HTTP until interrupted.",
+)
+@click.option(
+    "--benchmark",
+    type=click.IntRange(min=1),
+    metavar="COUNT",
+    help="Measure the cost of generating COUNT tokens.",
+)
+def generate_webhook(
+    service_config, namespace, repo_name, bulk, output_format, serve, benchmark
+):
     """Generate a secret token to be used to set up webhooks in GitLab.
 
     SEVICE_CONFIG is a Packit-as-a-Service configuration file, having a
@@ -24,18 +190,31 @@ def generate_webhook(service_config, namespace, repo_name):
 
     The optional REPO_NAME is the name of the repo for which the token
     is generated. Leave it out if you generate a token for the namespace.
+
+    Instead of NAMESPACE and REPO_NAME, --bulk can be used to generate
+    tokens for many repositories at once, or --serve to run a local HTTP
+    endpoint, which returns a token for 'GET /?namespace=…&repo_name=…'
+    and tokens (as JSON lines) for 'NAMESPACE [REPO_NAME]' lines POSTed
+    to '/'.
     """
-    with open(service_config, "r") as fp:
-        data = yaml.safe_load(fp)
-        gitlab_token_secret = data["gitlab_token_secret"]
-    payload = {"namespace": namespace}
-    if repo_name:
-        payload["repo_name"] = repo_name
-    token = jwt.encode(payload, gitlab_token_secret, algorithm="HS256")
-    # https://pyjwt.readthedocs.io/en/latest/changelog.html#jwt-encode-return-type
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
-    print(token)
+    modes = [namespace, bulk, serve, benchmark]
+    if sum(mode is not None for mode in modes) != 1:
+        raise click.UsageError(
+            "Provide exactly one of NAMESPACE, --bulk, --serve or --benchmark."
+        )
+
+    gitlab_token_secret = read_token_secret(service_config)
+    if benchmark:
+        run_benchmark(gitlab_token_secret, benchmark)
+        return
+
+    minter = TokenMinter(gitlab_token_secret)
+    if bulk:
+        write_tokens(minter, read_repositories(bulk), sys.stdout, output_format)
+    elif serve:
+        serve_tokens(minter, serve)
+    else:
+        print(minter.mint(namespace, repo_name))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+"""Access to the key-value database (Valkey/Redict/Redis) of a deployment."""
+
+import socket
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import IO, Iterator, List, Optional
+
+import click
+import redis
+
+DEFAULT_NAMESPACE = "packit--prod"
+# value of 'kv_database' in the vars, used as the 'component' label
+DEFAULT_COMPONENT = "valkey"
+PORT = 6379
+# number of keys requested from a single SCAN call
+SCAN_COUNT = 1000
+# patterns of keys counted separately
+PATTERNS = ["celery-task-meta-*", "celery-*", "_kombu.*", "unacked*", "*queue*"]
+# results of Celery tasks
+CELERY_META_PATTERN = "celery-task-meta-*"
+# Celery queues (lists) of the workers, 'celery' is the default one
+QUEUES = ["celery", "short-running", "long-running", "rate-limited"]
+
+
+def connection_options(func):
+    """Options selecting the database, either in a cluster or a local one."""
+
+    @click.option(
+        "--namespace",
+        default=DEFAULT_NAMESPACE,
+        show_default=True,
+        help="OpenShift namespace of the deployment.",
+    )
+    @click.option(
+        "--component",
+        default=DEFAULT_COMPONENT,
+        show_default=True,
+        help="The 'component' label of the database pod (valkey, redict, redis).",
+    )
+    @click.option(
+        "--host",
+        help="Connect directly to the database on HOST "
+        "(e.g. a local container) instead of port-forwarding to the pod.",
+    )
+    @click.option(
+        "--port", default=PORT, show_default=True, help="Port of the database."
+    )
+    @click.option("--db", default=0, show_default=True, help="Database number.")
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def get_pod(namespace: str, component: str) -> str:
+    pod = subprocess.run(
+        [
+            "oc",
+            "get",
+            "pod",
+            "-n",
+            namespace,
+            "-l",
+            f"component={component}",
+            "-o",
+            "jsonpath={.items[0].metadata.name}",
+        ],
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    if not pod:
+        raise click.ClickException(f"No {component} pod found in namespace {namespace}")
+    return pod
+
+
+def oc_exec(namespace: str, pod: str, *command: str) -> str:
+    return subprocess.run(
+        ["oc", "exec", "-n", namespace, pod, "--", *command],
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def drain(stream: IO[str]) -> None:
+    for _ in stream:
+        pass
+
+
+@contextmanager
+def port_forward(namespace: str, pod: str, port: int = PORT) -> Iterator[int]:
+    """Forward a local port to the pod, yields the local port."""
+    local_port = get_free_port()
+    # errors are read only if the forwarding fails, a file doesn't block oc
+    # like a full pipe would in long runs
+    with tempfile.TemporaryFile("w+") as stderr:
+        process = subprocess.Popen(
+            [
+                "oc",
+                "port-forward",
+                "-n",
+                namespace,
+                f"pod/{pod}",
+                f"{local_port}:{port}",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            text=True,
+        )
+        try:
+            # 'Forwarding from 127.0.0.1:<local_port> -> 6379' once ready
+            if not process.stdout.readline().startswith("Forwarding from"):
+                process.wait()
+                stderr.seek(0)
+                raise click.ClickException(
+                    f"Port-forwarding to {pod} failed: {stderr.read().strip()}"
+                )
+            # 'Handling connection for <local_port>' is printed for every
+            # connection, keep reading it
+            threading.Thread(
+                target=drain,
+                args=(process.stdout,),
+                name="oc-port-forward",
+                daemon=True,
+            ).start()
+            yield local_port
+        finally:
+            process.terminate()
+            process.wait()
+
+
+@contextmanager
+def connect(
+    namespace: str = DEFAULT_NAMESPACE,
+    component: str = DEFAULT_COMPONENT,
+    host: Optional[str] = None,
+    port: int = PORT,
+    db: int = 0,
+) -> Iterator[redis.Redis]:
+    """Connect to the database, through a single port-forward to the pod
+    unless the host is given."""
+    if host:
+        with redis.Redis(host=host, port=port, db=db) as client:
+            yield client
+        return
+
+    with port_forward(namespace, get_pod(namespace, component), port) as local_port:
+        with redis.Redis(host="127.0.0.1", port=local_port, db=db) as client:
+            yield client
+
+
+def scan_batches(
+    client: redis.Redis, match: Optional[str] = None, count: int = SCAN_COUNT
+) -> Iterator[List[bytes]]:
+    """Iterate over the whole keyspace in batches of keys returned by SCAN.
+
+    A key may be returned more than once if the keyspace is rehashed
+    while scanning.
+    """
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor=cursor, match=match, count=count)
+        if keys:
+            yield keys
+        if cursor == 0:
+            break
+
+
+def decode_key(key: bytes) -> str:
+    return key.decode("utf-8", errors="backslashreplace")
@@ -3,16 +3,21 @@
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
 
-from collections import deque
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import date, datetime, timedelta
 from pathlib import Path
+import random
 import subprocess
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import click
 from copr.v3 import Client
-from git import Repo, GitConfigParser
+from git import GitConfigParser
 
 import changelog
 
@@ -38,6 +43,8 @@ STABLE_BRANCH: str = "stable"
 ROLLING_BRANCH: str = "main"
 DEFAULT_REPO_STORE: str = "move_stable_repositories"
 MONOREPO: str = "production-monorepo"
+# how many repositories are fetched at the same time
+DEFAULT_FETCH_JOBS: int = 4
 
 # Copr settings
 COPR_OWNER, COPR_PROJECT = "packit", "packit-stable"
@@ -46,7 +53,53 @@ COPR_DEPENDENCIES: Dict[str, List[Tuple[str, str]]] = {
     "packit": [("python-ogr", "ogr"), ("python-specfile", "specfile")],
     "packit-service": [("packit", "packit")],
 }
-END_OF_QUEUE = None
+# Copr is polled with a growing interval (with jitter) while nothing changes,
+# a new build of the package resets the interval to the minimum
+COPR_POLL_MIN_INTERVAL: float = 5
+COPR_POLL_MAX_INTERVAL: float = 60
+COPR_POLL_BACKOFF: float = 2
+COPR_POLL_JITTER: float = 0.2
+
+
+class BuildStatusSource(ABC):
+    """Provides versions of the latest succeeded builds of the packages."""
+
+    @abstractmethod
+    async def get_built_version(self, package: str) -> Optional[str]:
+        """Version of the latest succeeded build, None if there is none."""
+
+
+class CoprBuildStatusSource(BuildStatusSource):
+    """Queries the Copr API.
+
+    The client is created from the Copr config file by default, which can
+    point to a local (fake) Copr instance as well.
+    """
+
+    def __init__(self, client: Optional[Client] = None) -> None:
+        self.client = client or Client.create_from_config_file()
+
+    async def get_built_version(self, package: str) -> Optional[str]:
+        # the Copr client is synchronous, don't block the other checks
+        package_info = await asyncio.to_thread(
+            self.client.package_proxy.get,
+            COPR_OWNER,
+            COPR_PROJECT,
+            package,
+            with_latest_succeeded_build=True,
+        )
+        latest_succeeded = package_info.builds["latest_succeeded"]
+        if not latest_succeeded:
+            return None
+        return latest_succeeded["source_package"]["version"]
+
+
+class RepositoryRefs(NamedTuple):
+    """Short hashes of the rolling and stable branches after a fetch."""
+
+    main_hash: str
+    stable_hash: str
+    fetch_duration: float
 
 
 @click.group()
@@ -132,13 +185,33 @@ def init(repo_store: str) -> None:
 def move_repository(
     repository: str, remote: str, repo_store: str, update_monorepo: bool
 ) -> None:
+    move_single_repository(repository, remote, repo_store, update_monorepo)
+
+
+def move_single_repository(
+    repository: str,
+    remote: str,
+    repo_store: str,
+    update_monorepo: bool,
+    refs: Optional[RepositoryRefs] = None,
+    copr_dependencies: Optional[Future] = None,
+) -> None:
+    """Move the stable branch of the repository interactively.
+
+    When refs are given (already fetched and resolved by
+    prefetch_repositories), the repository is not fetched again.
+    When copr_dependencies is given (started by
+    wait_for_copr_dependencies_in_background), only its result is awaited.
+    """
     click.secho(f"==> Moving {repository}", fg="yellow")
     path_to_repository = Path(repo_store, repository).absolute()
 
-    fetch_all(path_to_repository)
-
-    main_hash = get_reference(path_to_repository, remote, ROLLING_BRANCH)[:7]
-    stable_hash = get_reference(path_to_repository, remote, STABLE_BRANCH)[:7]
+    if refs is None:
+        fetch_all(path_to_repository)
+        main_hash = get_reference(path_to_repository, remote, ROLLING_BRANCH)[:7]
+        stable_hash = get_reference(path_to_repository, remote, STABLE_BRANCH)[:7]
+    else:
+        main_hash, stable_hash = refs.main_hash, refs.stable_hash
 
     if main_hash == stable_hash:
         click.echo(
@@ -148,7 +221,10 @@ def move_repository(
         return
 
     click.echo("===> Waiting for Copr dependencies")
-    wait_for_copr_dependencies(repository, remote, repo_store)
+    if copr_dependencies is None:
+        wait_for_copr_dependencies(repository, remote, repo_store)
+    else:
+        copr_dependencies.result()
 
     get_git_log(path_to_repository, remote, stable_hash, main_hash)
     click.echo()
@@ -204,8 +280,15 @@ def move_repository(
     type=click.Path(exists=True, dir_okay=True, file_okay=False),
     help="Path to dir where the repositories are stored",
 )
+@click.option(
+    "--jobs",
+    default=DEFAULT_FETCH_JOBS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="How many repositories to fetch at the same time",
+)
 @click.pass_context
-def move_all(ctx, remote: str, repo_store: str) -> None:
+def move_all(ctx, remote: str, repo_store: str, jobs: int) -> None:
     if not Path(repo_store).is_dir():
         click.echo(
             click.style(
@@ -215,14 +298,22 @@ def move_all(ctx, remote: str, repo_store: str) -> None:
         )
         exit(1)
 
+    all_refs = prefetch_repositories(repo_store, remote, jobs)
+    moved = {repository: threading.Event() for repository in REPOSITORIES}
+    copr_dependencies = wait_for_copr_dependencies_in_background(
+        REPOSITORIES, remote, repo_store, moved
+    )
+
     for repository in REPOSITORIES:
-        ctx.invoke(
-            move_repository,
-            repository=repository,
-            remote=remote,
-            repo_store=repo_store,
+        move_single_repository(
+            repository,
+            remote,
+            repo_store,
             update_monorepo=False,
+            refs=all_refs[repository],
+            copr_dependencies=copr_dependencies[repository],
         )
+        moved[repository].set()
 
     # update monorepo
     click.secho(f"==> Updating references to {STABLE_BRANCH} in monorepo", fg="yellow")
@@ -322,11 +413,33 @@ def format_date(to_format: date) -> str:
     help="""Date until which Git commits are searched for release notes.
     By default, today.""",
 )
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help="Use the persistent cache of pull request descriptions.",
+)
+@click.option(
+    "--batch/--no-batch",
+    default=False,
+    show_default=True,
+    help="Fetch pull request descriptions in batches via GraphQL API.",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    help="""Path to a clone of packit.dev, the blog post is written directly
+    to the weekly/<year>/ directory in it.""",
+)
 def create_blogpost(
     remote: str,
     repo_store: str,
     since: Optional[datetime] = None,
     till: Optional[datetime] = None,
+    cache: bool = True,
+    batch: bool = False,
+    output: Optional[str] = None,
 ):
     click.echo(
         "Here is a template for this week's blogpost (modifications may be needed)\n"
@@ -359,10 +472,24 @@ def create_blogpost(
 
     today = datetime.today()
 
-    click.echo(
-        f"Please put it in an according directory: packit.dev/weekly/{since.year}/{file_name}\n"
-    )
-    click.echo(
+    blogpost_file = None
+    if output:
+        blogpost_path = Path(output, "weekly", str(since.year), file_name)
+        blogpost_path.parent.mkdir(parents=True, exist_ok=True)
+        blogpost_file = blogpost_path.open("w")
+        click.echo(f"Writing it to: {blogpost_path}\n")
+    else:
+        click.echo(
+            f"Please put it in an according directory: packit.dev/weekly/{since.year}/{file_name}\n"
+        )
+
+    def write(text: str) -> None:
+        click.echo(text)
+        if blogpost_file:
+            blogpost_file.write(f"{text}\n")
+            blogpost_file.flush()
+
+    write(
         "---\n"
         f"title: {title_text} in Packit\n"
         f"date: {today.strftime('%Y-%m-%d')}\n"
@@ -374,12 +501,45 @@ def create_blogpost(
         "---\n\n"
         f"## {title_text} ({format_date(since)} – {format_date(till)})\n"
     )
-    for repo in REPOS_FOR_BLOG:
-        path_to_repository = Path(repo_store, repo).absolute()
-        git_repo = Repo(path_to_repository)
-        main_hash = get_reference(path_to_repository, remote, ROLLING_BRANCH)[:7]
-        commits = git_repo.iter_commits(main_hash, merges=True, since=git_since)
-        click.echo(changelog.get_changelog(commits, repo, make_link=True).rstrip())
+    with (
+        changelog.PRDescriptionCache() if cache else nullcontext() as pr_cache,
+        blogpost_file or nullcontext(),
+        ThreadPoolExecutor(max_workers=len(REPOS_FOR_BLOG)) as executor,
+    ):
+        # collect the release notes from all the repositories at once,
+        sections = [
+            executor.submit(
+                get_blogpost_section,
+                repo,
+                remote,
+                repo_store,
+                git_since,
+                cache=pr_cache,
+                batch=batch,
+            )
+            for repo in REPOS_FOR_BLOG
+        ]
+        # but output them in the fixed order, each as soon as it's ready
+        for section in sections:
+            write(section.result())
+
+
+def get_blogpost_section(
+    repo: str,
+    remote: str,
+    repo_store: str,
+    git_since: date,
+    cache: Optional[changelog.PRDescriptionCache] = None,
+    batch: bool = False,
+) -> str:
+    path_to_repository = Path(repo_store, repo).absolute()
+    main_hash = get_reference(path_to_repository, remote, ROLLING_BRANCH)[:7]
+    commits = changelog.iter_merge_commits(
+        path_to_repository, main_hash, since=str(git_since)
+    )
+    return changelog.get_changelog(
+        commits, repo, make_link=True, cache=cache, batch=batch
+    ).rstrip()
 
 
 def get_reference(path_to_repository: Path, remote: str, branch: str) -> str:
@@ -406,6 +566,63 @@ def fetch_all(path_to_repository: Path) -> None:
     )
 
 
+def prefetch_repository(
+    path_to_repository: Path, remote: str, resolve_refs: bool = True
+) -> RepositoryRefs:
+    start = time.monotonic()
+    subprocess.run(
+        ["git", "fetch", "--all"], cwd=path_to_repository, capture_output=True
+    )
+    main_hash = stable_hash = ""
+    if resolve_refs:
+        main_hash = get_reference(path_to_repository, remote, ROLLING_BRANCH)[:7]
+        stable_hash = get_reference(path_to_repository, remote, STABLE_BRANCH)[:7]
+    return RepositoryRefs(main_hash, stable_hash, time.monotonic() - start)
+
+
+def prefetch_repositories(
+    repo_store: str, remote: str, jobs: int = DEFAULT_FETCH_JOBS
+) -> Dict[str, RepositoryRefs]:
+    """Fetch all the repositories and the monorepo concurrently and resolve
+    the references of the rolling and stable branches up front.
+
+    Returns the resolved references of each repository from REPOSITORIES.
+    """
+    click.secho(
+        f"==> Fetching {len(REPOSITORIES)} repositories and {MONOREPO} "
+        f"({jobs} at a time)",
+        fg="yellow",
+    )
+    start = time.monotonic()
+    all_refs: Dict[str, RepositoryRefs] = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                prefetch_repository,
+                Path(repo_store, repository).absolute(),
+                remote,
+                resolve_refs=repository != MONOREPO,
+            ): repository
+            for repository in [*REPOSITORIES, MONOREPO]
+        }
+        for future in as_completed(futures):
+            repository = futures[future]
+            refs = future.result()
+            all_refs[repository] = refs
+            click.echo(
+                f"===> Fetched {repository} in {refs.fetch_duration:.1f}s"
+                + (
+                    f" ({ROLLING_BRANCH}: {refs.main_hash}, "
+                    f"{STABLE_BRANCH}: {refs.stable_hash})"
+                    if repository != MONOREPO
+                    else ""
+                )
+            )
+
+    click.echo(f"===> All fetched in {time.monotonic() - start:.1f}s\n")
+    return all_refs
+
+
 def get_git_log(
     path_to_repository: Path, remote: str, hash_from: str, hash_to: str
 ) -> None:
@@ -433,49 +650,146 @@ def push_stable_branch(path_to_repository: Path, remote: str, commit_sha: str) -
     subprocess.run(["git", "push", remote, STABLE_BRANCH], cwd=path_to_repository)
 
 
-def wait_for_copr_dependencies(repository: str, remote: str, repo_store: str):
-    dependencies = COPR_DEPENDENCIES.get(repository, [])
+async def wait_for_copr_build(
+    dependency: Tuple[str, str],
+    remote: str,
+    repo_store: str,
+    source: BuildStatusSource,
+    moved: Optional[threading.Event] = None,
+) -> None:
+    package, repo_name = dependency
+    path_to_repository = Path(repo_store, repo_name)
+    if moved is not None:
+        # the build of the old stable branch doesn't count
+        await asyncio.to_thread(moved.wait)
+    interval = COPR_POLL_MIN_INTERVAL
+    last_version: Optional[str] = None
+
+    while True:
+        stable_ref = (
+            await asyncio.to_thread(
+                get_reference, path_to_repository, remote, STABLE_BRANCH
+            )
+        )[:7]
+        built_version = await source.get_built_version(package)
+
+        if built_version is not None and stable_ref in built_version:
+            click.secho(f"{package} has finished", fg="green")
+            return
+
+        if built_version != last_version:
+            # something has been built meanwhile, ours may be the next one
+            last_version = built_version
+            interval = COPR_POLL_MIN_INTERVAL
+        else:
+            interval = min(interval * COPR_POLL_BACKOFF, COPR_POLL_MAX_INTERVAL)
+
+        # cooldown to not spam the Copr API while the build is running
+        delay = interval * random.uniform(1 - COPR_POLL_JITTER, 1 + COPR_POLL_JITTER)
+        click.echo(
+            f"{package} has not finished yet ({stable_ref} not built, "
+            f"latest is {built_version}), checking again in {delay:.0f}s"
+        )
+        await asyncio.sleep(delay)
+
+
+async def wait_for_copr_dependencies_of(
+    repositories: List[str],
+    remote: str,
+    repo_store: str,
+    source: Optional[BuildStatusSource] = None,
+    moved: Optional[Dict[str, threading.Event]] = None,
+    on_unblocked: Optional[Callable[[str], None]] = None,
+) -> None:
+    """Wait for the Copr dependencies of all the repositories at once.
+
+    Each dependency is checked only once even if more repositories depend
+    on it, and each repository is reported as unblocked (and on_unblocked
+    is called with it) as soon as its own dependencies are built.
+    The dependencies having an event in moved are checked once it's set.
+    """
+    dependencies = {
+        dependency
+        for repository in repositories
+        for dependency in COPR_DEPENDENCIES.get(repository, [])
+    }
     if not dependencies:
         click.secho("No Copr dependencies set.", fg="green")
         return
 
-    client = Client.create_from_config_file()
-
-    queue = deque([*dependencies, END_OF_QUEUE])
-    with click.progressbar(
-        length=len(dependencies),
-        label="Waiting for Copr builds",
-        item_show_func=lambda item: item,
-        update_min_steps=0,
-    ) as bar:
-        while queue:
-            item = queue.popleft()
-
-            # cooldown to not spam the Copr API while the build is running
-            if item is END_OF_QUEUE:
-                # there is nothing else waiting except the cooldown, safe to skip
-                if not queue:
-                    continue
-
-                # execute the cooldown and add it back
-                time.sleep(30)
-                queue.append(END_OF_QUEUE)
-                continue
-
-            dependency, repo_name = item
-
-            bar.update(0, f"checking {dependency}")
-            path_to_repository = Path(repo_store, repo_name)
-            stable_ref = get_reference(path_to_repository, remote, STABLE_BRANCH)[:7]
-            built_version = client.package_proxy.get(
-                COPR_OWNER, COPR_PROJECT, dependency, with_latest_succeeded_build=True
-            ).builds["latest_succeeded"]["source_package"]["version"]
-
-            if stable_ref in built_version:
-                bar.update(1, f"{dependency} has finished")
-            else:
-                bar.update(0, f"{dependency} has not finished yet, requeued")
-                queue.append(item)
+    source = source or CoprBuildStatusSource()
+    builds = {
+        dependency: asyncio.create_task(
+            wait_for_copr_build(
+                dependency, remote, repo_store, source, (moved or {}).get(dependency[1])
+            )
+        )
+        for dependency in dependencies
+    }
+
+    async def unblock(repository: str) -> None:
+        await asyncio.gather(
+            *(builds[dependency] for dependency in COPR_DEPENDENCIES[repository])
+        )
+        click.secho(f"Copr dependencies of {repository} are built", fg="green")
+        if on_unblocked:
+            on_unblocked(repository)
+
+    await asyncio.gather(
+        *(
+            unblock(repository)
+            for repository in repositories
+            if COPR_DEPENDENCIES.get(repository)
+        )
+    )
+
+
+def wait_for_copr_dependencies(
+    repository: str,
+    remote: str,
+    repo_store: str,
+    source: Optional[BuildStatusSource] = None,
+):
+    asyncio.run(wait_for_copr_dependencies_of([repository], remote, repo_store, source))
+
+
+def wait_for_copr_dependencies_in_background(
+    repositories: List[str],
+    remote: str,
+    repo_store: str,
+    moved: Dict[str, threading.Event],
+    source: Optional[BuildStatusSource] = None,
+) -> Dict[str, Future]:
+    """Start waiting for the Copr dependencies of all the repositories.
+
+    The dependencies are checked in a thread, while the repositories are
+    moved one by one, each one after its stable branch is moved (its event
+    in moved is set). Returns a future for each repository, done once its
+    own dependencies are built.
+    """
+    unblocked: Dict[str, Future] = {repository: Future() for repository in repositories}
+    for repository in repositories:
+        if not COPR_DEPENDENCIES.get(repository):
+            unblocked[repository].set_result(None)
+
+    def unblock(repository: str) -> None:
+        unblocked[repository].set_result(None)
+
+    def wait() -> None:
+        try:
+            asyncio.run(
+                wait_for_copr_dependencies_of(
+                    repositories, remote, repo_store, source, moved, unblock
+                )
+            )
+        except Exception as ex:
+            # don't leave the remaining repositories waiting forever
+            for future in unblocked.values():
+                if not future.done():
+                    future.set_exception(ex)
+
+    threading.Thread(target=wait, daemon=True).start()
+    return unblocked
 
 
 def update_monorepo_references(
@@ -513,10 +827,13 @@ def update_monorepo_references(
 
 
 @cli.command(
-    short_help=f"Stalks Copr dependencies of a requested repository",
-    help=f"""Wait for the Copr dependencies of REPOSITORY.
+    short_help=f"Stalks Copr dependencies of requested repositories",
+    help=f"""Wait for the Copr dependencies of REPOSITORIES.
 
-    REPOSITORY is a Git repository cloned to repo store.
+    REPOSITORIES are Git repositories cloned to repo store. The dependencies
+    of all of them are checked at the same time. If no repository is given,
+    all the repositories with Copr dependencies are stalked, namely:
+    {', '.join(COPR_DEPENDENCIES)}.
 
     Example:
 
@@ -529,7 +846,7 @@ def update_monorepo_references(
                                       --repo-store . packit-service
     """,
 )
-@click.argument("repository", type=click.Path())
+@click.argument("repositories", nargs=-1, type=click.Path())
 @click.option(
     "--remote",
     default="origin",
@@ -543,8 +860,12 @@ def update_monorepo_references(
     type=click.Path(exists=True, dir_okay=True, file_okay=False),
     help="Path to dir where the repositories are stored",
 )
-def stalk_copr(repository: str, remote: str, repo_store: str) -> None:
-    wait_for_copr_dependencies(repository, remote, repo_store)
+def stalk_copr(repositories: Tuple[str, ...], remote: str, repo_store: str) -> None:
+    asyncio.run(
+        wait_for_copr_dependencies_of(
+            list(repositories or COPR_DEPENDENCIES), remote, repo_store
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "redis",
+# ]
+# ///
+
+"""Profile Celery tasks by their results stored in Valkey/Redict/Redis.
+
+The celery-task-meta-* keys are walked by SCAN, fetched by pipelined GETs
+a batch at a time and every result is decoded and added to the statistics
+of its task right away, only the statistics are kept in memory (runtimes
+of a task are kept as a fixed-size random sample for the percentiles).
+
+The name, queue and number of retries of a task are stored only with
+the extended results (result_extended), the runtime only when the time
+the task started is stored too (date_started); results without them
+are counted as such.
+
+Retries are related to celery_retry_limit and celery_retry_backoff of the
+deployment: a failure after the limit of retries was reached is counted
+as exhausted and the time spent waiting for the retries is estimated from
+the exponential backoff (backoff * 2^retry, at most RETRY_BACKOFF_MAX).
+"""
+
+import json
+import random
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, TextIO
+
+import click
+
+import kv_database
+
+# defaults of celery_retry_limit and celery_retry_backoff in the deploy role
+RETRY_LIMIT = 2
+RETRY_BACKOFF = 3
+# Celery caps the exponential backoff (retry_backoff_max)
+RETRY_BACKOFF_MAX = 600
+SAMPLE_SIZE = 10000
+PERCENTILES = [50, 90, 99]
+UNKNOWN = "<unknown>"
+
+
+class Reservoir:
+    """Uniform random sample of at most size values of a stream."""
+
+    def __init__(self, size: int, rng: random.Random) -> None:
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.values: List[float] = []
+
+    def add(self, value: float) -> None:
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        elif (index := self.rng.randrange(self.seen)) < self.size:
+            self.values[index] = value
+
+    def percentiles(self) -> Dict[str, float]:
+        if not self.values:
+            return {}
+        values = sorted(self.values)
+        if len(values) == 1:
+            cuts = [values[0]] * 99
+        else:
+            cuts = statistics.quantiles(values, n=100, method="inclusive")
+        return {
+            **{f"p{percentile}": cuts[percentile - 1] for percentile in PERCENTILES},
+            "max": values[-1],
+        }
+
+
+@dataclass
+class TaskStats:
+    sample: Reservoir
+    count: int = 0
+    states: Counter = field(default_factory=Counter)
+    queues: Counter = field(default_factory=Counter)
+    runtime_total: float = 0.0
+    retried: int = 0
+    retries: int = 0
+    exhausted: int = 0
+    retry_wait: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        failures = self.states["FAILURE"]
+        return {
+            "count": self.count,
+            "states": dict(self.states),
+            "failure_rate": failures / self.count if self.count else 0.0,
+            "queues": dict(self.queues),
+            "runtime": {
+                "measured": self.sample.seen,
+                "total": self.runtime_total,
+                "mean": (
+                    self.runtime_total / self.sample.seen if self.sample.seen else None
+                ),
+                **self.sample.percentiles(),
+            },
+            "retries": {
+                "retried": self.retried,
+                "total": self.retries,
+                "exhausted": self.exhausted,
+                "wait_estimate": self.retry_wait,
+            },
+        }
+
+
+def parse_date(value: Any) -> Optional[datetime]:
+    """Dates of Celery results are in UTC, with or without the offset."""
+    try:
+        date = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def retry_wait(retries: int, backoff: int) -> float:
+    return sum(min(backoff * 2**retry, RETRY_BACKOFF_MAX) for retry in range(retries))
+
+
+class Profile:
+    def __init__(
+        self, retry_limit: int, retry_backoff: int, sample_size: int, seed: int
+    ) -> None:
+        self.retry_limit = retry_limit
+        self.retry_backoff = retry_backoff
+        self.sample_size = sample_size
+        self.rng = random.Random(seed)
+        self.tasks: Dict[str, TaskStats] = {}
+        self.scanned = 0
+        self.undecodable = 0
+        self.without_name = 0
+
+    def add(self, value: Optional[bytes]) -> None:
+        if value is None:
+            # expired/removed since the SCAN
+            return
+        self.scanned += 1
+        try:
+            result = json.loads(value)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            # e.g. pickled results
+            self.undecodable += 1
+            return
+        if not isinstance(result, dict):
+            self.undecodable += 1
+            return
+
+        name = result.get("name") or UNKNOWN
+        if name == UNKNOWN:
+            self.without_name += 1
+        stats = self.tasks.get(name)
+        if stats is None:
+            stats = self.tasks[name] = TaskStats(Reservoir(self.sample_size, self.rng))
+        stats.count += 1
+        state = result.get("status") or UNKNOWN
+        stats.states[state] += 1
+        if queue := result.get("queue"):
+            stats.queues[queue] += 1
+
+        started, done = parse_date(result.get("date_started")), parse_date(
+            result.get("date_done")
+        )
+        if started and done and done >= started:
+            runtime = (done - started).total_seconds()
+            stats.runtime_total += runtime
+            stats.sample.add(runtime)
+
+        retries = result.get("retries")
+        if isinstance(retries, int) and retries > 0:
+            stats.retried += 1
+            stats.retries += retries
+            stats.retry_wait += retry_wait(retries, self.retry_backoff)
+            if state == "FAILURE" and retries >= self.retry_limit:
+                stats.exhausted += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        queues: Dict[str, Dict[str, float]] = {}
+        for stats in self.tasks.values():
+            for queue, count in stats.queues.items():
+                totals = queues.setdefault(queue, {"count": 0, "runtime_total": 0.0})
+                totals["count"] += count
+                # attribute the runtime by the share of the results in the queue
+                totals["runtime_total"] += stats.runtime_total * count / stats.count
+        return {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "retry_limit": self.retry_limit,
+            "retry_backoff": self.retry_backoff,
+            "results": self.scanned,
+            "undecodable": self.undecodable,
+            "without_name": self.without_name,
+            "queues": queues,
+            "tasks": {
+                name: stats.to_dict()
+                for name, stats in sorted(
+                    self.tasks.items(),
+                    key=lambda item: (-item[1].runtime_total, -item[1].count),
+                )
+            },
+        }
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def write_report(profile: Dict[str, Any], output: TextIO, top: int) -> None:
+    def report(line: str = "") -> None:
+        output.write(line + "\n")
+
+    report(f"Celery task profile, generated at {profile['generated_at']}")
+    report(
+        f"{profile['results']} results, {profile['undecodable']} undecodable,"
+        f" {profile['without_name']} without the task name (result_extended)"
+    )
+    report(f"Retry limit {profile['retry_limit']}, backoff {profile['retry_backoff']}s")
+    report()
+
+    tasks = list(profile["tasks"].items())[:top]
+    report("Runtime (by the total, where the worker time goes)")
+    report(
+        f"{'task':<60} {'measured':>8} {'total':>10} {'p50':>8} {'p90':>8}"
+        f" {'p99':>8} {'max':>8}"
+    )
+    for name, stats in tasks:
+        runtime = stats["runtime"]
+        report(
+            f"{name[-60:]:<60} {runtime['measured']:>8}"
+            f" {format_seconds(runtime['total']):>10}"
+            + "".join(
+                f" {format_seconds(runtime.get(key)):>8}"
+                for key in ("p50", "p90", "p99", "max")
+            )
+        )
+    report()
+
+    report("Failures and retries")
+    report(
+        f"{'task':<60} {'results':>8} {'failed':>8} {'retried':>8}"
+        f" {'retries':>8} {'exhausted':>9} {'waited':>10}"
+    )
+    for name, stats in sorted(
+        tasks, key=lambda item: (-item[1]["failure_rate"], -item[1]["count"])
+    ):
+        retries = stats["retries"]
+        report(
+            f"{name[-60:]:<60} {stats['count']:>8} {stats['failure_rate']:>8.1%}"
+            f" {retries['retried']:>8} {retries['total']:>8}"
+            f" {retries['exhausted']:>9} {format_seconds(retries['wait_estimate']):>10}"
+        )
+    report()
+
+    report("Queues")
+    for queue, totals in sorted(
+        profile["queues"].items(), key=lambda item: -item[1]["runtime_total"]
+    ):
+        report(
+            f"{queue:<20} {totals['count']:>8} results,"
+            f" {format_seconds(totals['runtime_total'])} runtime"
+        )
+
+
+@click.command()
+@kv_database.connection_options
+@click.option(
+    "--match",
+    default=kv_database.CELERY_META_PATTERN,
+    show_default=True,
+    help="Pattern of the keys of the results.",
+)
+@click.option(
+    "--batch-size",
+    default=kv_database.SCAN_COUNT,
+    show_default=True,
+    help="Number of keys requested from a single SCAN call.",
+)
+@click.option(
+    "--retry-limit",
+    default=RETRY_LIMIT,
+    show_default=True,
+    help="celery_retry_limit of the deployment.",
+)
+@click.option(
+    "--retry-backoff",
+    default=RETRY_BACKOFF,
+    show_default=True,
+    help="celery_retry_backoff of the deployment (seconds).",
+)
+@click.option(
+    "--sample-size",
+    default=SAMPLE_SIZE,
+    show_default=True,
+    help="Runtimes kept per task for the percentiles.",
+)
+@click.option("--seed", default=0, help="Seed of the runtime sampling.")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    show_default=True,
+)
+@click.option("--output", type=click.File("w"), default="-", help="Output file.")
+@click.option(
+    "--top", default=30, show_default=True, help="Tasks shown in the text report."
+)
+def main(
+    namespace,
+    component,
+    host,
+    port,
+    db,
+    match,
+    batch_size,
+    retry_limit,
+    retry_backoff,
+    sample_size,
+    seed,
+    output_format,
+    output,
+    top,
+):
+    """Per-task runtime percentiles, failure rates and retries from the results."""
+    profile = Profile(retry_limit, retry_backoff, sample_size, seed)
+    start = time.monotonic()
+    with kv_database.connect(namespace, component, host, port, db) as client:
+        for keys in kv_database.scan_batches(client, match, batch_size):
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.get(key)
+            for value in pipeline.execute(raise_on_error=False):
+                profile.add(value if isinstance(value, bytes) else None)
+            click.echo(f"\rProfiled {profile.scanned} results", nl=False, err=True)
+    click.echo(
+        f"\rProfiled {profile.scanned} results in {time.monotonic() - start:.1f}s",
+        err=True,
+    )
+
+    result = profile.to_dict()
+    if output_format == "json":
+        json.dump(result, output, indent=2)
+        output.write("\n")
+    else:
+        write_report(result, output, top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "redis",
+# ]
+# ///
+
+"""Remove (or set expiry of) old Celery task results in Valkey/Redict/Redis.
+
+The keyspace is walked incrementally by SCAN, the payloads and TTLs of the
+matching keys are fetched and the selected keys are unlinked (or expired)
+with pipelines, a batch at a time, so the server is never blocked by a
+single long command. The number of reaped keys per second is capped and
+the reaping pauses while the server responds slowly or the Celery queues
+grow. The SCAN cursor is saved into a checkpoint file after every batch,
+so an interrupted run can be resumed.
+"""
+
+import json
+import re
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import click
+import redis
+
+import kv_database
+
+# states of finished tasks, the results of the others may still be awaited
+READY_STATES = ["SUCCESS", "FAILURE", "REVOKED"]
+ALL_STATES = READY_STATES + ["PENDING", "RECEIVED", "STARTED", "RETRY"]
+DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+# the lowest round trip of these PINGs at the start is the baseline latency
+BASELINE_PINGS = 5
+
+
+def parse_duration(ctx, param, value: Optional[str]) -> Optional[timedelta]:
+    if value is None:
+        return None
+    match = DURATION_RE.match(value)
+    if not match:
+        raise click.BadParameter("use a number with a unit, e.g. 90m, 12h or 7d")
+    return timedelta(seconds=float(match[1]) * DURATION_UNITS[match[2]])
+
+
+@dataclass
+class Checkpoint:
+    """Progress of a run, saved after every batch."""
+
+    match: str
+    cursor: int = 0
+    scanned: int = 0
+    reaped: int = 0
+    failed: int = 0
+    reclaimed: int = 0
+
+    @classmethod
+    def load(cls, path: Optional[Path], match: str) -> "Checkpoint":
+        if not path or not path.is_file():
+            return cls(match)
+        checkpoint = cls(**json.loads(path.read_text()))
+        if checkpoint.match != match:
+            raise click.ClickException(
+                f"{path} is a checkpoint of reaping {checkpoint.match!r}, remove it"
+                " to start over"
+            )
+        return checkpoint
+
+    def save(self, path: Optional[Path]) -> None:
+        if path:
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(asdict(self)))
+            tmp.replace(path)
+
+
+def parse_date_done(payload: dict) -> Optional[datetime]:
+    """date_done of Celery results is in UTC, with or without the offset."""
+    try:
+        date_done = datetime.fromisoformat(payload["date_done"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if date_done.tzinfo is None:
+        date_done = date_done.replace(tzinfo=timezone.utc)
+    return date_done
+
+
+def select_keys(
+    keys: List[bytes],
+    values: List[Optional[bytes]],
+    ttls: List[int],
+    states: Tuple[str, ...],
+    finished_before: Optional[datetime],
+    include_expiring: bool,
+) -> List[bytes]:
+    selected = []
+    for key, value, ttl in zip(keys, values, ttls):
+        # -2: gone in the meantime, >= 0: expires on its own
+        if value is None or ttl == -2 or (ttl >= 0 and not include_expiring):
+            continue
+        try:
+            payload = json.loads(value)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            # not a result stored by the JSON serializer, leave it alone
+            continue
+        if not isinstance(payload, dict) or payload.get("status") not in states:
+            continue
+        if finished_before:
+            date_done = parse_date_done(payload)
+            if date_done is None or date_done > finished_before:
+                continue
+        selected.append(key)
+    return selected
+
+
+class Throttle:
+    """Caps the rate of reaped keys and waits while the server is busy.
+
+    The latency is compared with the baseline measured at the start, which
+    includes the round trip to the cluster (through the port-forward).
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        max_rate: float,
+        max_latency: float,
+        max_queue_length: Optional[int],
+        pause: float,
+    ) -> None:
+        self.client = client
+        self.max_rate = max_rate
+        self.max_latency = max_latency
+        self.max_queue_length = max_queue_length
+        self.pause = pause
+        self.baseline = min(self.ping() for _ in range(BASELINE_PINGS))
+        self.start = time.monotonic()
+        self.paused = 0.0
+
+    def ping(self) -> float:
+        start = time.monotonic()
+        self.client.ping()
+        return time.monotonic() - start
+
+    def busy(self) -> Optional[str]:
+        latency = self.ping()
+        if latency - self.baseline > self.max_latency:
+            return (
+                f"latency {latency * 1000:.1f} ms"
+                f" (baseline {self.baseline * 1000:.1f} ms)"
+            )
+        if self.max_queue_length is not None:
+            pipeline = self.client.pipeline(transaction=False)
+            for queue in kv_database.QUEUES:
+                pipeline.llen(queue)
+            length = sum(pipeline.execute())
+            if length > self.max_queue_length:
+                return f"{length} tasks in the queues"
+        return None
+
+    def wait(self, reaped: int) -> None:
+        # the rate is computed from the start of the run, without the pauses
+        ahead = reaped / self.max_rate - (time.monotonic() - self.start - self.paused)
+        if ahead > 0:
+            time.sleep(ahead)
+        while reason := self.busy():
+            click.echo(f"Pausing for {self.pause}s, {reason}", err=True)
+            time.sleep(self.pause)
+            self.paused += self.pause
+
+
+def reap(
+    client: redis.Redis,
+    checkpoint: Checkpoint,
+    checkpoint_path: Optional[Path],
+    throttle: Throttle,
+    batch_size: int,
+    states: Tuple[str, ...],
+    finished_before: Optional[datetime],
+    include_expiring: bool,
+    expire_in: Optional[int],
+    dry_run: bool,
+) -> None:
+    # keys reaped by the previous runs don't count towards the rate
+    reaped_before = checkpoint.reaped
+    while True:
+        checkpoint.cursor, keys = client.scan(
+            cursor=checkpoint.cursor, match=checkpoint.match, count=batch_size
+        )
+        checkpoint.scanned += len(keys)
+        if keys:
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.get(key)
+                pipeline.ttl(key)
+            results = pipeline.execute(raise_on_error=False)
+            values, ttls = results[0::2], results[1::2]
+            selected = select_keys(
+                keys, values, ttls, states, finished_before, include_expiring
+            )
+            if selected:
+                pipeline = client.pipeline(transaction=False)
+                for key in selected:
+                    pipeline.memory_usage(key, samples=0)
+                reclaimed = pipeline.execute(raise_on_error=False)
+                checkpoint.reclaimed += sum(
+                    size for size in reclaimed if isinstance(size, int)
+                )
+                if dry_run:
+                    checkpoint.reaped += len(selected)
+                else:
+                    pipeline = client.pipeline(transaction=False)
+                    for key in selected:
+                        if expire_in is None:
+                            pipeline.unlink(key)
+                        else:
+                            pipeline.expire(key, expire_in)
+                    for key, reply in zip(
+                        selected, pipeline.execute(raise_on_error=False)
+                    ):
+                        if isinstance(reply, Exception):
+                            checkpoint.failed += 1
+                            click.echo(
+                                f"\nFailed to reap {kv_database.decode_key(key)}:"
+                                f" {reply}",
+                                err=True,
+                            )
+                        # 0: gone in the meantime
+                        elif reply:
+                            checkpoint.reaped += 1
+
+        if not dry_run:
+            checkpoint.save(checkpoint_path)
+        click.echo(
+            f"\rScanned {checkpoint.scanned}, reaped {checkpoint.reaped}"
+            f" ({checkpoint.reclaimed / 1024 / 1024:.1f} MiB)",
+            nl=False,
+            err=True,
+        )
+        if checkpoint.cursor == 0:
+            click.echo(err=True)
+            return
+        throttle.wait(checkpoint.reaped - reaped_before)
+
+
+@click.group()
+def cli():
+    """Reap old Celery task results."""
+
+
+@cli.command("reap")
+@kv_database.connection_options
+@click.option(
+    "--match",
+    default=kv_database.CELERY_META_PATTERN,
+    show_default=True,
+    help="Pattern of the keys of the results.",
+)
+@click.option(
+    "--older-than",
+    callback=parse_duration,
+    help="Reap only results of tasks finished longer ago, e.g. 12h or 7d.",
+)
+@click.option(
+    "--state",
+    "states",
+    multiple=True,
+    type=click.Choice(ALL_STATES),
+    default=READY_STATES,
+    show_default=True,
+    help="Reap only results in this state, repeatable.",
+)
+@click.option(
+    "--include-expiring",
+    is_flag=True,
+    help="Reap also results with an expiry set, only the ones without are by default.",
+)
+@click.option(
+    "--expire-in",
+    callback=parse_duration,
+    help="Set expiry of the results instead of unlinking them, e.g. 1d.",
+)
+@click.option(
+    "--batch-size",
+    default=kv_database.SCAN_COUNT,
+    show_default=True,
+    help="Number of keys requested from a single SCAN call.",
+)
+@click.option(
+    "--max-rate",
+    default=5000.0,
+    show_default=True,
+    help="Maximum number of reaped keys per second.",
+)
+@click.option(
+    "--max-latency",
+    default=10.0,
+    show_default=True,
+    help="Pause while the round trip of PING takes longer than at the start"
+    " by more than this (milliseconds).",
+)
+@click.option(
+    "--max-queue-length",
+    type=int,
+    help="Pause while there are more tasks in the Celery queues.",
+)
+@click.option(
+    "--pause",
+    default=5.0,
+    show_default=True,
+    help="Seconds to pause for when the server is busy.",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Save the progress into the file and resume from it if it exists.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only count the results to be reaped and their memory.",
+)
+def reap_command(
+    namespace,
+    component,
+    host,
+    port,
+    db,
+    match,
+    older_than,
+    states,
+    include_expiring,
+    expire_in,
+    batch_size,
+    max_rate,
+    max_latency,
+    max_queue_length,
+    pause,
+    checkpoint_path,
+    dry_run,
+):
+    """Unlink (or expire) Celery task results."""
+    checkpoint = Checkpoint.load(checkpoint_path, match)
+    if checkpoint.cursor:
+        click.echo(
+            f"Resuming from {checkpoint_path}, {checkpoint.scanned} keys scanned",
+            err=True,
+        )
+    finished_before = datetime.now(timezone.utc) - older_than if older_than else None
+    with kv_database.connect(namespace, component, host, port, db) as client:
+        used_before = client.info("memory")["used_memory"]
+        throttle = Throttle(
+            client, max_rate, max_latency / 1000, max_queue_length, pause
+        )
+        click.echo(
+            f"Baseline latency {throttle.baseline * 1000:.1f} ms, pausing above"
+            f" {(throttle.baseline * 1000 + max_latency):.1f} ms",
+            err=True,
+        )
+        reap(
+            client,
+            checkpoint,
+            checkpoint_path,
+            throttle,
+            batch_size,
+            tuple(states),
+            finished_before,
+            include_expiring,
+            int(expire_in.total_seconds()) if expire_in is not None else None,
+            dry_run,
+        )
+        used_after = client.info("memory")["used_memory"]
+
+    if checkpoint_path and not dry_run:
+        # finished, the next run starts over
+        checkpoint_path.unlink(missing_ok=True)
+    action = "expired" if expire_in is not None else "unlinked"
+    click.echo(
+        f"{checkpoint.reaped} of {checkpoint.scanned} scanned keys"
+        f" {'would be ' if dry_run else ''}{action},"
+        f" {checkpoint.reclaimed / 1024 / 1024:.1f} MiB by MEMORY USAGE"
+    )
+    if not dry_run and expire_in is None:
+        # unlinked keys are freed in the background, the drop may come later
+        click.echo(
+            f"Used memory {used_before / 1024 / 1024:.1f} MiB →"
+            f" {used_after / 1024 / 1024:.1f} MiB"
+        )
+    if checkpoint.failed:
+        raise click.ClickException(f"Failed to reap {checkpoint.failed} keys")
+
+
+@cli.command()
+@click.option(
+    "--host", default="localhost", show_default=True, help="Local database host."
+)
+@click.option("--port", default=kv_database.PORT, show_default=True)
+@click.option("--db", default=0, show_default=True)
+@click.option("--count", default=1_000_000, show_default=True)
+@click.option(
+    "--days",
+    default=30,
+    show_default=True,
+    help="Spread date_done of the results over this many past days.",
+)
+def seed(host, port, db, count, days):
+    """Fill a local database with Celery task results, for testing.
+
+    Every tenth result is still pending and every third one has an expiry.
+    """
+    now = datetime.now(timezone.utc)
+    with redis.Redis(host=host, port=port, db=db) as client:
+        pipeline = client.pipeline(transaction=False)
+        for i in range(count):
+            state = (
+                "PENDING" if i % 10 == 0 else ("FAILURE" if i % 7 == 0 else "SUCCESS")
+            )
+            payload = {
+                "status": state,
+                "result": None if state == "PENDING" else {"index": i},
+                "traceback": None,
+                "children": [],
+                "date_done": (
+                    None
+                    if state == "PENDING"
+                    else (now - timedelta(days=days * i / count)).isoformat()
+                ),
+                "task_id": f"seed-{i}",
+            }
+            key = f"celery-task-meta-seed-{i}"
+            pipeline.set(key, json.dumps(payload), ex=86400 if i % 3 == 0 else None)
+            if i % 10_000 == 9_999:
+                pipeline.execute()
+        pipeline.execute()
+    click.echo(f"Stored {count} results in {host}:{port}/{db}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "jinja2",
+#   "pyyaml",
+# ]
+# ///
+
+"""Render the manifests of a deployment into a single multi-document bundle.
+
+The components and their templates are read from tasks/deploy-components.yml,
+the variables are loaded once (role defaults, vars/<service>/<deployment>.yml,
+extra-vars.yml and the facts of tasks/set-facts.yml and
+tasks/set-deployment-facts.yml) and all the templates are rendered in one
+Jinja environment, without Ansible. Objects are stamped with the same digest
+annotation as when deployed by Ansible, so the bundle can be applied at once:
+
+    oc apply --server-side -n <project> -f bundle.yml
+
+Rendered templates are cached, keyed by the template and the variables,
+together with the files they looked up, a change of them invalidates the entry.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from difflib import unified_diff
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+import click
+import yaml
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, pass_context
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+CACHE_DIR = (
+    Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "packit-deployment"
+    / "manifests"
+)
+# vars with a value depending on the environment or the cluster
+NOT_RESOLVED = {"service", "deployment"}
+ANSIBLE_MANAGED = "Ansible managed"
+# remove rendered templates not used for a week
+CACHE_TTL = 7 * 24 * 60 * 60
+
+
+class RenderedObject(NamedTuple):
+    component: str
+    template: str
+    definition: Dict[str, Any]
+
+
+def to_nice_yaml(data: Any, indent: int = 4, **kwargs) -> str:
+    return yaml.dump(
+        data, indent=indent, allow_unicode=True, default_flow_style=False, **kwargs
+    )
+
+
+def items2dict(items: List[dict], key_name="key", value_name="value") -> dict:
+    return {item[key_name]: item[value_name] for item in items}
+
+
+def b64encode(data: Any) -> str:
+    """Binary files looked up are strings with surrogates, as in Ansible."""
+    if not isinstance(data, bytes):
+        data = str(data).encode(errors="surrogateescape")
+    return base64.b64encode(data).decode()
+
+
+def create_environment() -> Environment:
+    """Jinja environment with what the templates use of Ansible."""
+    env = Environment(
+        loader=FileSystemLoader(PROJECT_DIR),
+        undefined=StrictUndefined,
+        keep_trailing_newline=True,
+        # same as the template lookup of Ansible
+        trim_blocks=True,
+    )
+    env.filters.update(
+        b64encode=b64encode,
+        b64decode=lambda string: base64.b64decode(string).decode(),
+        to_json=lambda data, **kwargs: json.dumps(data, **kwargs),
+        to_yaml=lambda data, **kwargs: yaml.dump(data, allow_unicode=True, **kwargs),
+        to_nice_yaml=to_nice_yaml,
+        items2dict=items2dict,
+        bool=lambda value: str(value).lower() in ("1", "true", "yes", "on"),
+        hash=lambda data, algorithm="sha1": hashlib.new(
+            algorithm, str(data).encode()
+        ).hexdigest(),
+    )
+
+    # files read by the lookups, they invalidate the cached templates
+    read_files: Set[str] = set()
+
+    @pass_context
+    def lookup(context, plugin: str, term: str, **kwargs) -> str:
+        # terms of the lookups in the templates are templates themselves
+        path = Path(env.from_string(term).render(context.get_all()))
+        if plugin in ("file", "template"):
+            read_files.add(str(path.resolve()))
+        if plugin == "file":
+            # Ansible reads the files as bytes and keeps undecodable bytes
+            # (e.g. fedora.keytab) as surrogates, b64encode restores them
+            content = path.read_bytes().decode(errors="surrogateescape")
+            return content.rstrip() if kwargs.get("rstrip", True) else content
+        if plugin == "template":
+            return env.from_string(path.read_text()).render(context.get_all())
+        if plugin == "env":
+            return os.getenv(str(path), "")
+        raise click.ClickException(f"Lookup {plugin!r} is not supported")
+
+    env.globals["lookup"] = lookup
+    env.read_files = read_files
+    return env
+
+
+def resolve(env: Environment, value: Any, context: Dict[str, Any]) -> Any:
+    """Template the strings in the value, e.g. 'quay.io/...:{{ deployment }}'."""
+    if isinstance(value, dict):
+        return {key: resolve(env, item, context) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(env, item, context) for item in value]
+    if not isinstance(value, str) or "{{" not in value:
+        return value
+    rendered = env.from_string(value).render(context)
+    # "{{ workers_all_tasks > 0 }}" is a boolean in Ansible
+    if value.startswith("{{") and value.endswith("}}"):
+        try:
+            return yaml.safe_load(rendered)
+        except yaml.YAMLError:
+            pass
+    return rendered
+
+
+def load_vars(
+    env: Environment,
+    service: str,
+    deployment: str,
+    path_to_secrets: Optional[Path],
+    with_secrets: bool,
+) -> Dict[str, Any]:
+    """The variables the deploy role sees when rendering the templates."""
+    variables: Dict[str, Any] = {}
+    variables.update(
+        yaml.safe_load((PROJECT_DIR / "roles/deploy/defaults/main.yml").read_text())
+    )
+    vars_file = PROJECT_DIR / "vars" / service / f"{deployment}.yml"
+    if not vars_file.is_file():
+        raise click.ClickException(
+            f"{vars_file} doesn't exist, create it from {vars_file.parent}/{deployment}_template.yml"
+        )
+    variables.update(yaml.safe_load(vars_file.read_text()) or {})
+    variables.update(
+        service=service,
+        deployment=deployment,
+        project_dir=str(PROJECT_DIR),
+        ansible_managed=ANSIBLE_MANAGED,
+    )
+    if path_to_secrets:
+        variables["path_to_secrets"] = str(path_to_secrets)
+
+    # Ansible templates the variables lazily, each one is resolved once here,
+    # in the order of the files, which is the order they depend on each other.
+    for name in variables:
+        if name not in NOT_RESOLVED:
+            variables[name] = resolve(env, variables[name], variables)
+
+    # tasks/set-facts.yml
+    variables["managed_platform"] = "api.mpp" in variables["host"]
+    variables["with_sandbox"] = service == "packit"
+    if variables["with_sandbox"]:
+        variables["sandbox_namespace"] = (
+            f"{variables['tenant']}--{deployment}-sandbox"
+            if variables["managed_platform"]
+            else f"{service}-{deployment}-sandbox"
+        )
+    if variables["managed_platform"] and deployment in ("stg", "prod"):
+        variables["servicephase"] = "preprod" if deployment == "stg" else "prod"
+    variables["redis_hostname"] = variables["kv_database"]
+    variables["bw_uri"] = f"ansible://{service}/{deployment}"
+    # tasks/set-deployment-facts.yml
+    variables["flower_htpasswd_path"] = (
+        f"{variables['path_to_secrets']}/flower-htpasswd"
+    )
+
+    if with_secrets:
+        extra_vars = Path(variables["path_to_secrets"]) / "extra-vars.yml"
+        if not extra_vars.is_file():
+            raise click.ClickException(
+                f"{extra_vars} doesn't exist, run 'make download-secrets' or use --no-secrets"
+            )
+        variables["vault"] = yaml.safe_load(extra_vars.read_text())
+        if deployment != "dev":
+            variables["git_forges"] = get_git_forges(variables["bw_uri"])
+    return variables
+
+
+def get_git_forges(bw_uri: str) -> List[dict]:
+    """Same as the community.general.bitwarden lookup in tasks/set-facts.yml."""
+    try:
+        output = subprocess.run(
+            ["bw", "list", "items", "--search", f"{bw_uri}/git"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as ex:
+        raise click.ClickException(
+            f"Can't get git forges from Bitwarden ({ex}), unlock the vault"
+            " (export BW_SESSION) or use --no-secrets"
+        ) from ex
+    return json.loads(output)
+
+
+def get_components(env: Environment, variables: Dict[str, Any]) -> List[dict]:
+    """Enabled components of tasks/deploy-components.yml, resolved."""
+    tasks = yaml.safe_load((PROJECT_DIR / "tasks/deploy-components.yml").read_text())
+    components = next(
+        task["ansible.builtin.set_fact"]["deploy_components"]
+        for task in tasks
+        if "deploy_components" in task.get("ansible.builtin.set_fact", {})
+    )
+    components = [resolve(env, component, variables) for component in components]
+    return [component for component in components if component.get("enabled", True)]
+
+
+def digest(definition: Dict[str, Any]) -> str:
+    """Same as in tasks/deploy-wave.yml: to_json(sort_keys=True) | hash('sha256')."""
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+def digest_annotation() -> str:
+    return yaml.safe_load((PROJECT_DIR / "roles/deploy/defaults/main.yml").read_text())[
+        "k8s_digest_annotation"
+    ]
+
+
+class RenderCache:
+    """Rendered templates keyed by a hash of the template and the variables.
+
+    Each entry keeps the fingerprints of the files the template looked up
+    (secrets, scripts) and is used only while they are unchanged.
+
+    The rendered secrets are stored as well, so the directory and the files
+    are accessible only by the owner, and entries not used for CACHE_TTL
+    are removed.
+    """
+
+    def __init__(self, path: Path, ttl: int = CACHE_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(template: str, source: str, variables: Dict[str, Any]) -> str:
+        return hashlib.sha256(
+            json.dumps(
+                [template, source, variables], sort_keys=True, default=str
+            ).encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            entry = json.loads((self.path / key).read_text())
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        if entry["files"] != files_fingerprint(entry["files"]):
+            self.misses += 1
+            return None
+        # mtime is the time of the last use
+        (self.path / key).touch()
+        self.hits += 1
+        return entry["rendered"]
+
+    def set(self, key: str, rendered: str, files: Set[str]) -> None:
+        self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp = self.path / f"{key}.tmp"
+        tmp.touch(mode=0o600)
+        tmp.write_text(
+            json.dumps({"files": files_fingerprint(files), "rendered": rendered})
+        )
+        tmp.replace(self.path / key)
+
+    def prune(self) -> None:
+        if not self.path.is_dir():
+            return
+        expired = time.time() - self.ttl
+        for entry in self.path.iterdir():
+            if entry.stat().st_mtime < expired:
+                entry.unlink(missing_ok=True)
+
+
+def files_fingerprint(files: Iterable[str]) -> Dict[str, Optional[List[int]]]:
+    """path → [size, mtime], None if the file doesn't exist"""
+    fingerprint: Dict[str, Optional[List[int]]] = {}
+    for file in sorted(files):
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            fingerprint[file] = None
+        else:
+            fingerprint[file] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def render_components(
+    env: Environment,
+    variables: Dict[str, Any],
+    components: List[dict],
+    cache: Optional[RenderCache],
+) -> Iterator[RenderedObject]:
+    for component in components:
+        context = {**variables, **component.get("vars", {})}
+        for template in component["templates"]:
+            source = (PROJECT_DIR / template).read_text()
+            key = RenderCache.key(template, source, context)
+            rendered = cache.get(key) if cache else None
+            if rendered is None:
+                env.read_files.clear()
+                rendered = env.get_template(template).render(context)
+                if cache:
+                    cache.set(key, rendered, env.read_files)
+            for definition in yaml.safe_load_all(rendered):
+                if definition:
+                    yield RenderedObject(component["name"], template, definition)
+
+
+def write_bundle(objects: List[RenderedObject], header: str, output) -> None:
+    annotation = digest_annotation()
+    output.write(header)
+    for obj in objects:
+        definition = obj.definition
+        metadata = definition.setdefault("metadata", {})
+        metadata["annotations"] = {
+            **(metadata.get("annotations") or {}),
+            annotation: digest(obj.definition),
+        }
+        output.write(f"---\n# {obj.component}: {obj.template}\n")
+        output.write(yaml.safe_dump(definition, sort_keys=False, allow_unicode=True))
+
+
+@click.group()
+def cli():
+    """Render manifests of a deployment into a bundle and compare bundles."""
+
+
+@cli.command()
+@click.option(
+    "--service",
+    envvar="SERVICE",
+    default="packit",
+    show_default=True,
+    type=click.Choice(
+        [path.name for path in (PROJECT_DIR / "vars").iterdir() if path.is_dir()]
+    ),
+)
+@click.option(
+    "--deployment",
+    envvar="DEPLOYMENT",
+    required=True,
+    type=click.Choice(["dev", "stg", "prod"]),
+)
+@click.option(
+    "--component",
+    "selected",
+    multiple=True,
+    help="Render only this component (see tasks/deploy-components.yml), repeatable.",
+)
+@click.option(
+    "--path-to-secrets",
+    envvar="PATH_TO_SECRETS",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Directory with the secrets, secrets/<service>/<deployment>/ by default.",
+)
+@click.option(
+    "--secrets/--no-secrets",
+    "with_secrets",
+    default=True,
+    show_default=True,
+    help="Render the secrets, --no-secrets needs neither the secret files nor Bitwarden.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    show_default=True,
+    help="Bundle file.",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    show_default=True,
+    help=f"Use the cache of rendered templates in {CACHE_DIR}.",
+)
+def render(service, deployment, selected, path_to_secrets, with_secrets, output, cache):
+    """Render the components of a deployment into a single bundle."""
+    start = time.monotonic()
+    env = create_environment()
+    variables = load_vars(env, service, deployment, path_to_secrets, with_secrets)
+    components = get_components(env, variables)
+    if not with_secrets:
+        components = [c for c in components if c["name"] != "secrets"]
+    if selected:
+        unknown = set(selected) - {component["name"] for component in components}
+        if unknown:
+            raise click.ClickException(
+                f"Unknown or disabled components: {', '.join(sorted(unknown))}"
+            )
+        components = [c for c in components if c["name"] in selected]
+
+    render_cache = RenderCache(CACHE_DIR) if cache else None
+    objects = list(render_components(env, variables, components, render_cache))
+    if render_cache:
+        render_cache.prune()
+    write_bundle(
+        objects,
+        f"# {service}/{deployment} ({variables['project']}), rendered by {Path(__file__).name}\n",
+        output,
+    )
+    click.echo(
+        f"Rendered {len(objects)} objects of {len(components)} components"
+        f" in {time.monotonic() - start:.2f}s"
+        + (
+            f" (cache: {render_cache.hits} hits, {render_cache.misses} misses)"
+            if render_cache
+            else ""
+        ),
+        err=True,
+    )
+
+
+def load_bundle(path: Path, annotation: str) -> Dict[str, Dict[str, Any]]:
+    """kind/name → definition without the digest annotation"""
+    objects = {}
+    for definition in yaml.safe_load_all(path.read_text()):
+        if not definition:
+            continue
+        annotations = definition.get("metadata", {}).get("annotations") or {}
+        annotations.pop(annotation, None)
+        if not annotations:
+            definition["metadata"].pop("annotations", None)
+        objects[f"{definition['kind']}/{definition['metadata']['name']}"] = definition
+    return objects
+
+
+def mask_secret(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace values of a secret with their digests."""
+    if definition.get("kind") != "Secret":
+        return definition
+    masked = dict(definition)
+    for field in ("data", "stringData"):
+        if field in masked:
+            masked[field] = {
+                key: "sha256:" + hashlib.sha256(str(value).encode()).hexdigest()[:12]
+                for key, value in masked[field].items()
+            }
+    return masked
+
+
+@cli.command()
+@click.argument("old", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.argument("new", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--show-secrets", is_flag=True, help="Don't mask values of secrets.")
+def diff(old, new, show_secrets):
+    """Show differences between two bundles, offline.
+
+    Exits with 1 if the bundles differ, like diff(1).
+    """
+    annotation = digest_annotation()
+    old_objects, new_objects = load_bundle(old, annotation), load_bundle(
+        new, annotation
+    )
+
+    def dump(objects: Dict[str, Dict[str, Any]], name: str) -> str:
+        if name not in objects:
+            return ""
+        definition = objects[name] if show_secrets else mask_secret(objects[name])
+        return yaml.safe_dump(definition, sort_keys=True, allow_unicode=True)
+
+    differ = False
+    for name in sorted(old_objects.keys() | new_objects.keys()):
+        before, after = dump(old_objects, name), dump(new_objects, name)
+        if before == after:
+            continue
+        differ = True
+        sys.stdout.writelines(
+            unified_diff(
+                before.splitlines(keepends=True),
+                after.splitlines(keepends=True),
+                fromfile=f"{old}: {name}" if before else "/dev/null",
+                tofile=f"{new}: {name}" if after else "/dev/null",
+            )
+        )
+    sys.exit(1 if differ else 0)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "kubernetes",
+#   "redis",
+# ]
+# ///
+
+"""Scale the packit-worker StatefulSets by the depth and age of their queues.
+
+Every interval the Celery queues are sampled (see export_queue_metrics.py)
+and each StatefulSet gets enough replicas for the messages waiting in the
+queues it serves (the QUEUES variable of its pod template), at least one
+more if the oldest message waits for too long, within its bounds:
+
+- scaling up is done at once, scaling down by one replica at a time,
+  both only after a cooldown since the last scaling (kept in an annotation
+  of the StatefulSet, so it survives restarts of the controller)
+- a StatefulSet with volumeClaimTemplates (the repository cache of the
+  long-running workers) gets a PVC per replica, and its sandcastle pods
+  another one in the sandbox namespace (created by 'make deploy');
+  new PVCs start empty and are never removed when scaling down, so it's
+  not scaled above the number of replicas having both PVCs unless
+  --allow-new-pvcs is given
+- the backlog of a queue is counted for every StatefulSet serving it,
+  packit-worker serves all the queues, so scale either it or
+  the short-running and long-running ones, not both
+
+'make deploy' sets the replicas from the vars again (workers_*), keep
+them at the lower bounds.
+
+    $ scale_workers.py --namespace packit--stg --worker packit-worker-long-running=1:4 --dry-run
+"""
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import click
+import redis
+import urllib3
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+import kv_database
+from export_queue_metrics import QueueSampler
+from wait_for_ready import get_api_client
+
+SCALED_AT_ANNOTATION = "packit-deployment/scaled-at"
+CONTAINER = "packit-worker"
+INTERVAL = 30
+
+
+@dataclass
+class Bounds:
+    min: int
+    max: int
+
+
+@dataclass
+class Worker:
+    name: str
+    replicas: int
+    queues: List[str]
+    scaled_at: float
+    # None if the StatefulSet has no volumeClaimTemplates
+    pvcs: Optional[int]
+
+
+@dataclass
+class QueueStats:
+    length: int
+    age: float
+
+
+def parse_bounds(ctx, param, values: Tuple[str, ...]) -> Dict[str, Bounds]:
+    bounds = {}
+    for value in values:
+        name, _, limits = value.partition("=")
+        try:
+            minimum, maximum = (int(limit) for limit in limits.split(":"))
+        except ValueError:
+            raise click.BadParameter(f"{value!r}, use NAME=MIN:MAX") from None
+        if not 0 <= minimum <= maximum:
+            raise click.BadParameter(f"{value!r}, MIN has to be <= MAX")
+        bounds[name] = Bounds(minimum, maximum)
+    return bounds
+
+
+def get_pvc_names(api_client: client.ApiClient, namespace: str) -> Set[str]:
+    return {
+        pvc.metadata.name
+        for pvc in client.CoreV1Api(api_client)
+        .list_namespaced_persistent_volume_claim(namespace)
+        .items
+    }
+
+
+def get_workers(
+    api_client: client.ApiClient,
+    namespace: str,
+    sandbox_namespace: str,
+    names: List[str],
+) -> List[Worker]:
+    apps = client.AppsV1Api(api_client)
+    pvc_names = get_pvc_names(api_client, namespace)
+    sandbox_pvc_names: Optional[Set[str]] = None
+    workers = []
+    for name in names:
+        statefulset = apps.read_namespaced_stateful_set(name, namespace)
+        container = next(
+            (
+                container
+                for container in statefulset.spec.template.spec.containers
+                if container.name == CONTAINER
+            ),
+            None,
+        )
+        if container is None:
+            raise click.ClickException(f"{name} has no {CONTAINER} container")
+        queues = next(
+            (env.value for env in container.env or [] if env.name == "QUEUES"), ""
+        )
+        annotations = statefulset.metadata.annotations or {}
+        templates = statefulset.spec.volume_claim_templates or []
+        pvcs = None
+        if templates:
+            if sandbox_pvc_names is None:
+                sandbox_pvc_names = get_pvc_names(api_client, sandbox_namespace)
+            # <template name>-<statefulset name>-<ordinal>, for all the templates,
+            # and the one of the sandcastle pods of the replica
+            pvcs = 0
+            while (
+                all(
+                    f"{template.metadata.name}-{name}-{pvcs}" in pvc_names
+                    for template in templates
+                )
+                and f"sandcastle-repository-cache-{name}-{pvcs}" in sandbox_pvc_names
+            ):
+                pvcs += 1
+        workers.append(
+            Worker(
+                name=name,
+                replicas=statefulset.spec.replicas,
+                queues=[queue for queue in queues.split(",") if queue],
+                scaled_at=float(annotations.get(SCALED_AT_ANNOTATION, 0)),
+                pvcs=pvcs,
+            )
+        )
+    return workers
+
+
+def get_queue_stats(
+    sampler: QueueSampler, kv_client: redis.Redis
+) -> Dict[str, QueueStats]:
+    stats: Dict[str, QueueStats] = {}
+    for name, _, labels, value in sampler.sample(kv_client):
+        if name == "celery_queue_length":
+            stats[labels["queue"]] = QueueStats(int(value), 0.0)
+        elif name == "celery_queue_oldest_message_age_seconds":
+            stats[labels["queue"]].age = value
+    return stats
+
+
+def decide(
+    worker: Worker,
+    stats: Dict[str, QueueStats],
+    bounds: Bounds,
+    tasks_per_worker: int,
+    max_age: float,
+    up_cooldown: float,
+    down_cooldown: float,
+    allow_new_pvcs: bool,
+    now: float,
+) -> Tuple[int, str]:
+    """Returns the number of replicas and the reason."""
+    queues = [stats[queue] for queue in worker.queues if queue in stats]
+    length = sum(queue.length for queue in queues)
+    age = max((queue.age for queue in queues), default=0.0)
+    reason = f"{length} waiting, the oldest for {age:.0f}s"
+
+    desired = math.ceil(length / tasks_per_worker)
+    if age > max_age:
+        desired = max(desired, worker.replicas + 1)
+    desired = min(max(desired, bounds.min), bounds.max)
+    if worker.pvcs is not None and not allow_new_pvcs:
+        limit = max(worker.pvcs, worker.replicas, bounds.min)
+        if desired > limit:
+            desired = limit
+            reason += f", limited by {worker.pvcs} repository cache PVCs"
+
+    since_scaled = now - worker.scaled_at
+    if desired > worker.replicas:
+        if since_scaled < up_cooldown:
+            return (
+                worker.replicas,
+                f"{reason}, scaling up in {up_cooldown - since_scaled:.0f}s",
+            )
+        return desired, reason
+    if desired < worker.replicas:
+        if since_scaled < down_cooldown:
+            return (
+                worker.replicas,
+                f"{reason}, scaling down in {down_cooldown - since_scaled:.0f}s",
+            )
+        # gradually, a spike may come back
+        return worker.replicas - 1, reason
+    return worker.replicas, reason
+
+
+def get_shared_queues(workers: List[Worker]) -> Dict[str, List[str]]:
+    """queue → StatefulSets serving it, for the queues served by more of them"""
+    served_by: Dict[str, List[str]] = {}
+    for worker in workers:
+        for queue in worker.queues:
+            served_by.setdefault(queue, []).append(worker.name)
+    return {queue: names for queue, names in served_by.items() if len(names) > 1}
+
+
+def scale(
+    api_client: client.ApiClient, namespace: str, name: str, replicas: int
+) -> None:
+    client.AppsV1Api(api_client).patch_namespaced_stateful_set(
+        name,
+        namespace,
+        {
+            "metadata": {"annotations": {SCALED_AT_ANNOTATION: f"{time.time():.0f}"}},
+            "spec": {"replicas": replicas},
+        },
+    )
+
+
+@click.command()
+@kv_database.connection_options
+@click.option(
+    "--worker",
+    "bounds",
+    multiple=True,
+    required=True,
+    callback=parse_bounds,
+    help="StatefulSet to scale and its bounds as NAME=MIN:MAX, repeatable.",
+)
+@click.option(
+    "--tasks-per-worker",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="Waiting messages a single replica is expected to handle.",
+)
+@click.option(
+    "--max-age",
+    default=300.0,
+    show_default=True,
+    help="Add a replica if the oldest message waits longer (seconds).",
+)
+@click.option(
+    "--scale-up-cooldown",
+    default=120.0,
+    show_default=True,
+    help="Seconds since the last scaling to scale up again.",
+)
+@click.option(
+    "--scale-down-cooldown",
+    default=900.0,
+    show_default=True,
+    help="Seconds since the last scaling to scale down again.",
+)
+@click.option(
+    "--sandbox-namespace",
+    help="Namespace of the sandcastle pods with their repository cache PVCs."
+    "  [default: NAMESPACE-sandbox]",
+)
+@click.option(
+    "--allow-new-pvcs",
+    is_flag=True,
+    help="Scale above the number of existing repository cache PVCs.",
+)
+@click.option("--interval", default=INTERVAL, show_default=True)
+@click.option("--once", is_flag=True, help="Decide once and exit.")
+@click.option("--dry-run", is_flag=True, help="Only log the decisions.")
+@click.option(
+    "--api-host",
+    envvar="K8S_AUTH_HOST",
+    help="API server URL, current context of kubeconfig is used if not set.",
+)
+@click.option("--api-key", envvar="K8S_AUTH_API_KEY", help="API token.")
+@click.option(
+    "--validate-certs/--no-validate-certs",
+    envvar="K8S_AUTH_VERIFY_SSL",
+    default=True,
+    show_default=True,
+)
+def main(
+    namespace,
+    component,
+    host,
+    port,
+    db,
+    bounds,
+    tasks_per_worker,
+    max_age,
+    scale_up_cooldown,
+    scale_down_cooldown,
+    sandbox_namespace,
+    allow_new_pvcs,
+    interval,
+    once,
+    dry_run,
+    api_host,
+    api_key,
+    validate_certs,
+):
+    """Scale the worker StatefulSets between their bounds by their queues."""
+    if not validate_certs:
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    api_client = get_api_client(api_host, api_key, validate_certs)
+    # packit--stg → packit--stg-sandbox, see tasks/set-facts.yml
+    sandbox_namespace = sandbox_namespace or f"{namespace}-sandbox"
+    sampler = QueueSampler(kv_database.QUEUES)
+    warned = False
+    with kv_database.connect(namespace, component, host, port, db) as kv_client:
+        while True:
+            start = time.monotonic()
+            try:
+                stats = get_queue_stats(sampler, kv_client)
+                workers = get_workers(
+                    api_client, namespace, sandbox_namespace, list(bounds)
+                )
+                shared = get_shared_queues(workers)
+                if shared and not warned:
+                    # e.g. packit-worker serves all the queues
+                    click.secho(
+                        "Queues served by more of the StatefulSets, their messages"
+                        " are counted for each of them: "
+                        + ", ".join(
+                            f"{queue} ({', '.join(names)})"
+                            for queue, names in sorted(shared.items())
+                        ),
+                        fg="yellow",
+                        err=True,
+                    )
+                    warned = True
+                for worker in workers:
+                    replicas, reason = decide(
+                        worker,
+                        stats,
+                        bounds[worker.name],
+                        tasks_per_worker,
+                        max_age,
+                        scale_up_cooldown,
+                        scale_down_cooldown,
+                        allow_new_pvcs,
+                        time.time(),
+                    )
+                    action = (
+                        f"{worker.replicas} → {replicas}"
+                        if replicas != worker.replicas
+                        else f"stays at {replicas}"
+                    )
+                    click.echo(
+                        f"{time.strftime('%H:%M:%S')} {worker.name}: {action} ({reason})"
+                    )
+                    if replicas != worker.replicas and not dry_run:
+                        scale(api_client, namespace, worker.name, replicas)
+            except (redis.RedisError, ApiException, urllib3.exceptions.HTTPError) as ex:
+                if once:
+                    raise click.ClickException(str(ex)) from ex
+                # keep going, the database or the API may be unavailable for a while
+                click.echo(f"Failed to scale the workers: {ex}", err=True)
+            if once:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+if __name__ == "__main__":
+    main()
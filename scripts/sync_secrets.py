@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+# ]
+# ///
+
+"""Download attachments of vault items into a directory, incrementally.
+
+Each item is fetched once and only the attachments which are new, were
+re-uploaded (attachments are replaced by deleting and creating them, see
+update_bw_secret.sh, so they get a new ID) or whose local copy was changed
+or removed are downloaded, concurrently. IDs and hashes of the downloaded
+attachments are kept in a manifest file in the directory.
+
+The vault is Bitwarden ('bw' CLI, the session is expected in BW_SESSION)
+or a directory with a subdirectory per item, which can stand in for
+the vault in tests:
+
+    $ sync_secrets.py --vault-dir /tmp/vault --output secrets/packit/stg secrets-packit-stg
+"""
+
+import hashlib
+import json
+import subprocess
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+import click
+
+MANIFEST_NAME = ".secrets-manifest.json"
+DOWNLOAD_WORKERS = 8
+
+
+class Attachment(NamedTuple):
+    item_id: str
+    item_name: str
+    id: str
+    file_name: str
+
+
+class Backend(ABC):
+    """Vault with items having files attached."""
+
+    def sync(self) -> None:
+        """Refresh the local copy of the vault, if any."""
+
+    @abstractmethod
+    def get_attachments(self, item_name: str) -> List[Attachment]:
+        """Attachments of the item."""
+
+    @abstractmethod
+    def download(self, attachment: Attachment, path: Path) -> None:
+        """Save the attachment to the path."""
+
+
+class BitwardenBackend(Backend):
+    @staticmethod
+    def bw(*args: str) -> str:
+        try:
+            return subprocess.run(
+                ["bw", *args], check=True, capture_output=True, text=True
+            ).stdout
+        except FileNotFoundError as ex:
+            raise click.ClickException(
+                "'bw' command not found, see https://bitwarden.com/help/cli"
+            ) from ex
+        except subprocess.CalledProcessError as ex:
+            raise click.ClickException(
+                f"'bw {args[0]} {args[1]}' failed: {ex.stderr.strip()}"
+            ) from ex
+
+    def __init__(self, force_sync: bool = False) -> None:
+        self.force_sync = force_sync
+
+    def sync(self) -> None:
+        # without --force only changes since the last sync are pulled
+        self.bw("sync", *(["--force"] if self.force_sync else []))
+
+    def get_attachments(self, item_name: str) -> List[Attachment]:
+        item = json.loads(self.bw("get", "item", item_name))
+        return [
+            Attachment(item["id"], item_name, attachment["id"], attachment["fileName"])
+            for attachment in item.get("attachments") or []
+        ]
+
+    def download(self, attachment: Attachment, path: Path) -> None:
+        self.bw(
+            "get",
+            "attachment",
+            attachment.id,
+            "--itemid",
+            attachment.item_id,
+            "--output",
+            str(path),
+        )
+
+
+class DirectoryBackend(Backend):
+    """<root>/<item name>/<file name>, the ID of a file is its hash."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def get_attachments(self, item_name: str) -> List[Attachment]:
+        item = self.root / item_name
+        if not item.is_dir():
+            raise click.ClickException(f"Couldn't find {item_name} in {self.root}")
+        return [
+            Attachment(item_name, item_name, file_hash(file), file.name)
+            for file in sorted(item.iterdir())
+            if file.is_file()
+        ]
+
+    def download(self, attachment: Attachment, path: Path) -> None:
+        path.write_bytes(
+            (self.root / attachment.item_id / attachment.file_name).read_bytes()
+        )
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class Manifest:
+    """file name → item, attachment ID and hash of the downloaded file"""
+
+    def __init__(self, directory: Path) -> None:
+        self.path = directory / MANIFEST_NAME
+        try:
+            self.entries: Dict[str, Dict[str, str]] = json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def is_up_to_date(self, attachment: Attachment, path: Path) -> bool:
+        entry = self.entries.get(attachment.file_name)
+        return (
+            entry is not None
+            and entry["attachment_id"] == attachment.id
+            and path.is_file()
+            and file_hash(path) == entry["sha256"]
+        )
+
+    def update(self, attachment: Attachment, path: Path) -> None:
+        self.entries[attachment.file_name] = {
+            "item": attachment.item_name,
+            "attachment_id": attachment.id,
+            "sha256": file_hash(path),
+        }
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=2, sort_keys=True))
+        tmp.replace(self.path)
+
+
+def download(backend: Backend, attachment: Attachment, output: Path) -> Path:
+    """Download to a temporary directory first, not to leave a partial file behind."""
+    path = output / attachment.file_name
+    with tempfile.TemporaryDirectory(dir=output, prefix=".download-") as tmp:
+        downloaded = Path(tmp) / attachment.file_name
+        backend.download(attachment, downloaded)
+        downloaded.chmod(0o600)
+        downloaded.replace(path)
+    return path
+
+
+def sync_items(
+    backend: Backend,
+    items: List[str],
+    output: Path,
+    workers: int = DOWNLOAD_WORKERS,
+) -> Dict[str, List[str]]:
+    """Returns the downloaded and up-to-date file names."""
+    output.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(output)
+    attachments = [
+        attachment for item in items for attachment in backend.get_attachments(item)
+    ]
+    outdated = [
+        attachment
+        for attachment in attachments
+        if not manifest.is_up_to_date(attachment, output / attachment.file_name)
+    ]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            attachment: executor.submit(download, backend, attachment, output)
+            for attachment in outdated
+        }
+        for attachment, future in futures.items():
+            try:
+                manifest.update(attachment, future.result())
+            except click.ClickException as ex:
+                failed.append(f"{attachment.file_name}: {ex.message}")
+    # keep what has been downloaded even if some download failed
+    manifest.save()
+    if failed:
+        raise click.ClickException("Failed to download\n" + "\n".join(failed))
+
+    return {
+        "downloaded": [attachment.file_name for attachment in outdated],
+        "up to date": [
+            attachment.file_name
+            for attachment in attachments
+            if attachment not in outdated
+        ],
+    }
+
+
+@click.command()
+@click.argument("items", nargs=-1, required=True)
+@click.option(
+    "--output",
+    type=click.Path(file_okay=False, path_type=Path),
+    required=True,
+    help="Directory to download the attachments into.",
+)
+@click.option(
+    "--vault-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Use a directory with a subdirectory per item instead of Bitwarden.",
+)
+@click.option(
+    "--force-sync",
+    is_flag=True,
+    help="Pull the whole Bitwarden vault ('bw sync --force'), not only the changes.",
+)
+@click.option(
+    "--workers",
+    default=DOWNLOAD_WORKERS,
+    show_default=True,
+    help="Number of concurrent downloads.",
+)
+def main(items, output, vault_dir, force_sync, workers):
+    """Download new and changed attachments of ITEMS into a directory."""
+    backend: Backend = (
+        DirectoryBackend(vault_dir) if vault_dir else BitwardenBackend(force_sync)
+    )
+    backend.sync()
+    result = sync_items(backend, list(items), output, workers)
+    for state, file_names in result.items():
+        if file_names:
+            click.echo(f"{state}: {', '.join(sorted(file_names))}")
+    click.echo(
+        f"{len(result['downloaded'])} attachments downloaded,"
+        f" {len(result['up to date'])} up to date in {output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "jinja2",
+#   "pyyaml",
+# ]
+# ///
+
+"""Update secrets in OpenShift from a secrets/<service>/<deployment>/ directory.
+
+The secrets are rendered from their templates (openshift/secret-*.yml.j2,
+the 'secrets' component of tasks/deploy-components.yml) with the files of the
+directory, compared with the secrets in the cluster (fetched with a single
+'oc get') and only the secrets with changed keys are updated, each with one
+merge patch containing just the changed keys. The patch also updates the
+digest annotation, so the next 'make deploy' doesn't apply them again.
+Files are encoded the same way as by Ansible, binary ones (fedora.keytab)
+included, so the values of unchanged keys are equal to the deployed ones.
+
+It's up to you to log in to the right cluster.
+"""
+
+import json
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+
+import render_manifests
+
+
+class SecretChange(NamedTuple):
+    name: str
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    patch: Dict[str, Any]
+
+
+def oc(*args: str, input: Optional[str] = None) -> str:
+    try:
+        return subprocess.run(
+            ["oc", *args], input=input, check=True, capture_output=True, text=True
+        ).stdout
+    except subprocess.CalledProcessError as ex:
+        raise click.ClickException(
+            f"'oc {' '.join(args[:3])}' failed: {ex.stderr.strip()}"
+        ) from ex
+
+
+def render_secrets(
+    service: str, deployment: str, path_to_secrets: Optional[Path]
+) -> Tuple[Dict[str, Dict[str, Any]], str]:
+    """name → rendered Secret, and the project of the deployment"""
+    env = render_manifests.create_environment()
+    variables = render_manifests.load_vars(
+        env, service, deployment, path_to_secrets, with_secrets=True
+    )
+    components = [
+        component
+        for component in render_manifests.get_components(env, variables)
+        if component["name"] == "secrets"
+    ]
+    return {
+        obj.definition["metadata"]["name"]: obj.definition
+        for obj in render_manifests.render_components(
+            env, variables, components, cache=None
+        )
+        if obj.definition.get("kind") == "Secret"
+    }, variables["project"]
+
+
+def get_live_secrets(namespace: str, names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """All the secrets in one call, the missing ones are ignored."""
+    output = oc(
+        "get",
+        "secret",
+        *names,
+        "--namespace",
+        namespace,
+        "--ignore-not-found",
+        "-o",
+        "json",
+    )
+    if not output.strip():
+        return {}
+    result = json.loads(output)
+    # a single object is not wrapped in a List
+    items = result["items"] if result.get("kind") == "List" else [result]
+    return {item["metadata"]["name"]: item for item in items}
+
+
+def diff_secret(
+    rendered: Dict[str, Any], live: Dict[str, Any], prune: bool, annotation: str
+) -> Optional[SecretChange]:
+    data = rendered.get("data") or {}
+    live_data = live.get("data") or {}
+    added = sorted(data.keys() - live_data.keys())
+    changed = sorted(
+        key for key in data.keys() & live_data.keys() if data[key] != live_data[key]
+    )
+    removed = sorted(live_data.keys() - data.keys()) if prune else []
+    if not (added or changed or removed):
+        return None
+    patch_data: Dict[str, Any] = {key: data[key] for key in added + changed}
+    # null removes the key in a merge patch
+    patch_data.update({key: None for key in removed})
+    return SecretChange(
+        name=rendered["metadata"]["name"],
+        added=added,
+        changed=changed,
+        removed=removed,
+        patch={
+            "metadata": {
+                "annotations": {annotation: render_manifests.digest(rendered)}
+            },
+            "data": patch_data,
+        },
+    )
+
+
+@click.command()
+@click.option(
+    "--service",
+    envvar="SERVICE",
+    default="packit",
+    show_default=True,
+)
+@click.option(
+    "--deployment",
+    envvar="DEPLOYMENT",
+    required=True,
+    type=click.Choice(["dev", "stg", "prod"]),
+)
+@click.option(
+    "--path-to-secrets",
+    envvar="PATH_TO_SECRETS",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Directory with the secrets, secrets/<service>/<deployment>/ by default.",
+)
+@click.option(
+    "--namespace",
+    help="Namespace of the secrets, 'project' of the vars file by default.",
+)
+@click.option(
+    "--secret",
+    "selected",
+    multiple=True,
+    help="Update only this secret, repeatable.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Remove keys which are not in the template from the secrets.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Only show what would be updated, don't patch."
+)
+def main(service, deployment, path_to_secrets, namespace, selected, prune, dry_run):
+    """Update the changed keys of secrets in OpenShift."""
+    rendered, project = render_secrets(service, deployment, path_to_secrets)
+    namespace = namespace or project
+    if selected:
+        unknown = set(selected) - rendered.keys()
+        if unknown:
+            raise click.ClickException(
+                f"Unknown secrets: {', '.join(sorted(unknown))},"
+                f" known are: {', '.join(sorted(rendered))}"
+            )
+        rendered = {name: rendered[name] for name in selected}
+
+    annotation = render_manifests.digest_annotation()
+    live = get_live_secrets(namespace, sorted(rendered))
+    changes = []
+    for name, secret in rendered.items():
+        if name not in live:
+            click.echo(f"{name}: not in {namespace}, create it with 'make deploy'")
+            continue
+        change = diff_secret(secret, live[name], prune, annotation)
+        if not change:
+            click.echo(f"{name}: up to date")
+            continue
+        changes.append(change)
+        for label, keys in (
+            ("added", change.added),
+            ("changed", change.changed),
+            ("removed", change.removed),
+        ):
+            if keys:
+                click.echo(f"{name}: {label} {', '.join(keys)}")
+
+    if dry_run:
+        click.echo(f"Dry run, {len(changes)} secrets in {namespace} would be updated")
+        return
+    for change in changes:
+        oc(
+            "patch",
+            "secret",
+            change.name,
+            "--namespace",
+            namespace,
+            "--type",
+            "merge",
+            "--patch-file",
+            "/dev/stdin",
+            input=json.dumps(change.patch),
+        )
+    click.echo(
+        f"Updated {len(changes)} secrets in {namespace}, restart the pods using them"
+        " to pick up the changes."
+    )
+
+
+if __name__ == "__main__":
+    main()
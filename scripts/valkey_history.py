@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "redis",
+# ]
+# ///
+
+"""Track the capacity of Valkey/Redict/Redis over time and project its exhaustion.
+
+Snapshots (used memory, maxmemory, number of keys in total and per pattern,
+size of the RDB file and usage of the /data volume) are appended to
+a SQLite file, by every analyze_valkey.py run and by the 'snapshot' command,
+which needs just a few commands and a single SCAN pass over the key names,
+so it can be run from cron:
+
+    */30 * * * * scripts/valkey_history.py snapshot --namespace packit--prod
+
+The 'trend' command fits the growth rates of the used memory and disk
+by least squares and projects when maxmemory and the volume are exhausted.
+"""
+
+import fnmatch
+import json
+import os
+import random
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import click
+import redis
+
+import kv_database
+
+STORE_PATH = (
+    Path(os.getenv("XDG_DATA_HOME", Path.home() / ".local" / "share"))
+    / "packit-deployment"
+    / "valkey-history.sqlite"
+)
+# snapshots older than this are removed when a new one is saved
+RETENTION_DAYS = 365
+TREND_DAYS = 14
+DAY = 24 * 60 * 60
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    used_memory INTEGER NOT NULL,
+    maxmemory INTEGER NOT NULL,
+    keys INTEGER NOT NULL,
+    rdb_size INTEGER,
+    disk_used INTEGER,
+    disk_size INTEGER
+);
+CREATE INDEX IF NOT EXISTS snapshots_target_taken_at ON snapshots (target, taken_at);
+CREATE TABLE IF NOT EXISTS pattern_snapshots (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    pattern TEXT NOT NULL,
+    keys INTEGER NOT NULL,
+    memory INTEGER,
+    PRIMARY KEY (snapshot_id, pattern)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class Snapshot:
+    target: str
+    taken_at: float
+    used_memory: int
+    # 0 if not limited
+    maxmemory: int
+    keys: int
+    rdb_size: Optional[int] = None
+    disk_used: Optional[int] = None
+    disk_size: Optional[int] = None
+    # pattern → number of keys and their memory (if known)
+    patterns: Dict[str, Tuple[int, Optional[int]]] = field(default_factory=dict)
+
+
+def get_target(namespace: str, host: Optional[str], port: int, db: int) -> str:
+    return f"{host}:{port}/{db}" if host else namespace
+
+
+def open_store(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def save_snapshot(
+    connection: sqlite3.Connection,
+    snapshot: Snapshot,
+    retention_days: int = RETENTION_DAYS,
+) -> None:
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO snapshots (target, taken_at, used_memory, maxmemory, keys,"
+            " rdb_size, disk_used, disk_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                snapshot.target,
+                snapshot.taken_at,
+                snapshot.used_memory,
+                snapshot.maxmemory,
+                snapshot.keys,
+                snapshot.rdb_size,
+                snapshot.disk_used,
+                snapshot.disk_size,
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO pattern_snapshots (snapshot_id, pattern, keys, memory)"
+            " VALUES (?, ?, ?, ?)",
+            [
+                (cursor.lastrowid, pattern, keys, memory)
+                for pattern, (keys, memory) in snapshot.patterns.items()
+            ],
+        )
+        connection.execute(
+            "DELETE FROM snapshots WHERE target = ? AND taken_at < ?",
+            (snapshot.target, snapshot.taken_at - retention_days * DAY),
+        )
+
+
+def load_snapshots(
+    connection: sqlite3.Connection, target: str, since: float
+) -> List[Snapshot]:
+    snapshots: Dict[int, Snapshot] = {}
+    for row in connection.execute(
+        "SELECT id, target, taken_at, used_memory, maxmemory, keys, rdb_size,"
+        " disk_used, disk_size FROM snapshots"
+        " WHERE target = ? AND taken_at >= ? ORDER BY taken_at",
+        (target, since),
+    ):
+        snapshots[row[0]] = Snapshot(*row[1:])
+    for snapshot_id, pattern, keys, memory in connection.execute(
+        "SELECT p.snapshot_id, p.pattern, p.keys, p.memory FROM pattern_snapshots p"
+        " JOIN snapshots s ON s.id = p.snapshot_id"
+        " WHERE s.target = ? AND s.taken_at >= ?",
+        (target, since),
+    ):
+        snapshots[snapshot_id].patterns[pattern] = (keys, memory)
+    return list(snapshots.values())
+
+
+def get_disk(namespace: str, component: str) -> Tuple[int, int, Optional[int]]:
+    """Used and total bytes of the /data volume and the size of the RDB file."""
+    pod = kv_database.get_pod(namespace, component)
+    output = kv_database.oc_exec(
+        namespace,
+        pod,
+        "sh",
+        "-c",
+        "df -Pk /data | tail -n 1; stat -c %s /data/dump.rdb 2>/dev/null || echo",
+    ).splitlines()
+    try:
+        # Filesystem 1024-blocks Used Available Capacity Mounted on
+        fields = output[0].split()
+        disk_size, disk_used = int(fields[1]) * 1024, int(fields[2]) * 1024
+    except (IndexError, ValueError) as ex:
+        raise click.ClickException(f"Unexpected output of df: {output}") from ex
+    rdb_size = int(output[1]) if len(output) > 1 and output[1].isdigit() else None
+    return disk_used, disk_size, rdb_size
+
+
+def take_snapshot(
+    client: redis.Redis,
+    target: str,
+    batch_size: int = kv_database.SCAN_COUNT,
+    patterns: Sequence[str] = (),
+) -> Snapshot:
+    """Memory and key counts, the key names are scanned only for the patterns."""
+    pattern_keys = dict.fromkeys(patterns, 0)
+    if patterns:
+        for keys in kv_database.scan_batches(client, count=batch_size):
+            for key in keys:
+                name = kv_database.decode_key(key)
+                for pattern in patterns:
+                    if fnmatch.fnmatchcase(name, pattern):
+                        pattern_keys[pattern] += 1
+    return Snapshot(
+        target=target,
+        taken_at=time.time(),
+        used_memory=client.info("memory")["used_memory"],
+        maxmemory=int(client.config_get("maxmemory").get("maxmemory", 0)),
+        keys=client.dbsize(),
+        patterns={pattern: (keys, None) for pattern, keys in pattern_keys.items()},
+    )
+
+
+@dataclass
+class Fit:
+    # per day
+    slope: float
+    # value at the time of the last snapshot
+    current: float
+
+
+def fit(points: List[Tuple[float, float]]) -> Optional[Fit]:
+    """Least squares line through (time, value) points."""
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+    last = max(x for x, _ in points)
+    return Fit(slope * DAY, mean_y + slope * (last - mean_x))
+
+
+def projection(
+    points: List[Tuple[float, float]], limit: Optional[float], last: float
+) -> Dict[str, Optional[float]]:
+    """Growth per day and when the limit is reached (if at all)."""
+    line = fit(points)
+    result: Dict[str, Optional[float]] = {
+        "current": points[-1][1] if points else None,
+        "limit": limit,
+        "growth_per_day": line.slope if line else None,
+        "exhausted_at": None,
+    }
+    if line and limit and line.slope > 0:
+        result["exhausted_at"] = (
+            last + max(0.0, limit - line.current) / line.slope * DAY
+        )
+    return result
+
+
+def compute_trend(snapshots: List[Snapshot]) -> Dict:
+    last = snapshots[-1]
+    memory = [(s.taken_at, s.used_memory) for s in snapshots]
+    disk = [(s.taken_at, s.disk_used) for s in snapshots if s.disk_used is not None]
+    disk_size = next(
+        (s.disk_size for s in reversed(snapshots) if s.disk_size is not None), None
+    )
+    patterns = sorted({pattern for s in snapshots for pattern in s.patterns})
+    return {
+        "target": last.target,
+        "snapshots": len(snapshots),
+        "from": snapshots[0].taken_at,
+        "to": last.taken_at,
+        "memory": projection(memory, last.maxmemory or None, last.taken_at),
+        "disk": projection(disk, disk_size, last.taken_at),
+        "keys": projection(
+            [(s.taken_at, s.keys) for s in snapshots], None, last.taken_at
+        ),
+        "patterns": {
+            pattern: projection(
+                [
+                    (s.taken_at, s.patterns[pattern][0])
+                    for s in snapshots
+                    if pattern in s.patterns
+                ],
+                None,
+                last.taken_at,
+            )
+            for pattern in patterns
+        },
+    }
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(
+        "%Y-%m-%d %H:%M UTC"
+    )
+
+
+def format_bytes(size: float) -> str:
+    for unit in ["B", "K", "M", "G"]:
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def format_projection(
+    name: str, result: Dict[str, Optional[float]], in_bytes: bool, now: float
+) -> str:
+    formatter = format_bytes if in_bytes else (lambda value: f"{value:.0f}")
+    if result["growth_per_day"] is None:
+        return f"{name}: not enough snapshots"
+    line = (
+        f"{name}: {formatter(result['current'])}"
+        + (f" of {formatter(result['limit'])}" if result["limit"] else "")
+        + f", {'+' if result['growth_per_day'] >= 0 else '-'}"
+        f"{formatter(abs(result['growth_per_day']))}/day"
+    )
+    if result["exhausted_at"]:
+        days = (result["exhausted_at"] - now) / DAY
+        line += f", full in {days:.1f} days ({format_time(result['exhausted_at'])})"
+    elif result["limit"]:
+        line += ", not growing"
+    return line
+
+
+@click.group()
+@click.option(
+    "--store",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=STORE_PATH,
+    show_default=True,
+    help="SQLite file with the snapshots.",
+)
+@click.pass_context
+def cli(ctx, store):
+    """Track the capacity of the key-value database over time."""
+    ctx.obj = store
+
+
+@cli.command()
+@kv_database.connection_options
+@click.option(
+    "--patterns/--no-patterns",
+    default=True,
+    show_default=True,
+    help="Count the keys per pattern (a SCAN pass over the key names).",
+)
+@click.option(
+    "--batch-size",
+    default=kv_database.SCAN_COUNT,
+    show_default=True,
+    help="Number of keys requested from a single SCAN call.",
+)
+@click.pass_obj
+def snapshot(store, namespace, component, host, port, db, patterns, batch_size):
+    """Append a snapshot of the database to the store."""
+    target = get_target(namespace, host, port, db)
+    with kv_database.connect(namespace, component, host, port, db) as client:
+        result = take_snapshot(
+            client, target, batch_size, kv_database.PATTERNS if patterns else ()
+        )
+    if not host:
+        result.disk_used, result.disk_size, result.rdb_size = get_disk(
+            namespace, component
+        )
+    save_snapshot(open_store(store), result)
+    click.echo(
+        f"{target}: {format_bytes(result.used_memory)} used, {result.keys} keys"
+        + (
+            f", disk {format_bytes(result.disk_used)}"
+            f" of {format_bytes(result.disk_size)}"
+            if result.disk_size
+            else ""
+        )
+    )
+
+
+@cli.command()
+@click.option(
+    "--target",
+    default=kv_database.DEFAULT_NAMESPACE,
+    show_default=True,
+    help="Namespace (or HOST:PORT/DB of a direct connection) of the snapshots.",
+)
+@click.option(
+    "--days",
+    default=TREND_DAYS,
+    show_default=True,
+    help="Fit the snapshots of the last days.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    show_default=True,
+)
+@click.pass_obj
+def trend(store, target, days, output_format):
+    """Fit the growth rates and project when memory or disk are exhausted."""
+    now = time.time()
+    snapshots = load_snapshots(open_store(store), target, now - days * DAY)
+    if not snapshots:
+        raise click.ClickException(f"No snapshots of {target} in the last {days} days")
+    result = compute_trend(snapshots)
+    if output_format == "json":
+        click.echo(json.dumps(result, indent=2))
+        return
+
+    click.echo(
+        f"{target}: {result['snapshots']} snapshots from {format_time(result['from'])}"
+        f" to {format_time(result['to'])}"
+    )
+    click.echo(format_projection("Memory", result["memory"], True, now))
+    if result["disk"]["current"] is not None:
+        click.echo(format_projection("Disk", result["disk"], True, now))
+    click.echo(format_projection("Keys", result["keys"], False, now))
+    for pattern, projected in result["patterns"].items():
+        click.echo(format_projection(f"  {pattern}", projected, False, now))
+
+
+@cli.command()
+@click.option("--target", default="synthetic", show_default=True)
+@click.option("--days", default=30, show_default=True)
+@click.option(
+    "--every", default=60, show_default=True, help="Minutes between the snapshots."
+)
+@click.option(
+    "--memory", default=200, show_default=True, help="Used memory at the start (MiB)."
+)
+@click.option(
+    "--growth", default=10.0, show_default=True, help="Memory growth (MiB/day)."
+)
+@click.option("--maxmemory", default=1024, show_default=True, help="MiB.")
+@click.option("--disk-size", default=1024, show_default=True, help="MiB.")
+@click.option(
+    "--noise", default=0.05, show_default=True, help="Relative noise of the values."
+)
+@click.option("--seed", default=0)
+@click.pass_obj
+def seed(store, target, days, every, memory, growth, maxmemory, disk_size, noise, seed):
+    """Store synthetic snapshots with a linear growth, for testing."""
+    rng = random.Random(seed)
+    connection = open_store(store)
+    now = time.time()
+    count = days * 24 * 60 // every
+    for i in range(count):
+        elapsed_days = i * every / (24 * 60)
+        used = (memory + growth * elapsed_days) * 2**20
+        used *= 1 + rng.uniform(-noise, noise)
+        keys = int(used / 1024)
+        save_snapshot(
+            connection,
+            Snapshot(
+                target=target,
+                taken_at=now - (days - elapsed_days) * DAY,
+                used_memory=int(used),
+                maxmemory=maxmemory * 2**20,
+                keys=keys,
+                # RDB and the volume follow the memory
+                rdb_size=int(used * 0.6),
+                disk_used=int(used * 0.6 + 20 * 2**20),
+                disk_size=disk_size * 2**20,
+                patterns={kv_database.CELERY_META_PATTERN: (int(keys * 0.9), None)},
+            ),
+        )
+    click.echo(f"Stored {count} snapshots of {target} into {store}")
+
+
+if __name__ == "__main__":
+    cli()
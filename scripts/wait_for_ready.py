@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# Copyright Contributors to the Packit project.
+# SPDX-License-Identifier: MIT
+
+# /// script
+# dependencies = [
+#   "click",
+#   "kubernetes",
+# ]
+# ///
+
+"""Wait for pods to be Ready and for deployments to be rolled out.
+
+All the pods and deployments are followed at once: a single watcher
+consumes the events of the pod and deployment watch streams of the
+namespace (a watch covers a single resource type) and finishes as soon
+as everything is ready or anything fails.
+"""
+
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import click
+import urllib3
+from kubernetes import client, config, watch
+from kubernetes.client.exceptions import ApiException
+
+# reasons of a waiting container which won't resolve by waiting
+POD_FAILURE_REASONS = {
+    "CrashLoopBackOff",
+    "CreateContainerConfigError",
+    "CreateContainerError",
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "InvalidImageName",
+}
+# the watch is reopened after this time, it's closed by the server anyway
+WATCH_TIMEOUT = 300
+
+
+class Target:
+    """A pod or a deployment being waited for."""
+
+    def __init__(self, kind: str, name: str) -> None:
+        self.kind = kind
+        self.name = name
+        self.state = "not found"
+        self.ready_after: Optional[float] = None
+
+    def __str__(self) -> str:
+        return f"{self.kind}/{self.name}"
+
+
+def pod_state(pod: client.V1Pod) -> Tuple[str, bool, Optional[str]]:
+    """Returns the state, whether the pod is ready and a failure if any."""
+    status = pod.status
+    if status.phase == "Failed":
+        return "Failed", False, status.reason or status.message or "pod failed"
+    for container in (status.init_container_statuses or []) + (
+        status.container_statuses or []
+    ):
+        waiting = container.state.waiting if container.state else None
+        if waiting and waiting.reason:
+            failure = (
+                f"{container.name}: {waiting.reason} {waiting.message or ''}".strip()
+                if waiting.reason in POD_FAILURE_REASONS
+                else None
+            )
+            return waiting.reason, False, failure
+    ready = any(
+        condition.type == "Ready" and condition.status == "True"
+        for condition in status.conditions or []
+    )
+    return ("Ready" if ready else status.phase), ready, None
+
+
+def deployment_state(
+    deployment: client.V1Deployment,
+) -> Tuple[str, bool, Optional[str]]:
+    """Same as 'oc rollout status': the rollout is complete when all the
+    replicas are updated and available and no old replicas are left."""
+    spec, status = deployment.spec, deployment.status
+    replicas = spec.replicas if spec.replicas is not None else 1
+    updated = status.updated_replicas or 0
+    available = status.available_replicas or 0
+    total = status.replicas or 0
+    state = f"updated {updated}/{replicas}, available {available}/{replicas}"
+
+    for condition in status.conditions or []:
+        if (
+            condition.type == "Progressing"
+            and condition.reason == "ProgressDeadlineExceeded"
+        ):
+            return state, False, condition.message or condition.reason
+    if (status.observed_generation or 0) < deployment.metadata.generation:
+        return "waiting for the rollout to start", False, None
+    complete = updated >= replicas and total == updated and available >= updated
+    return ("rolled out" if complete else state), complete, None
+
+
+def stream_events(
+    list_func, namespace: str, events: queue.Queue, stop: threading.Event
+) -> None:
+    """Put events of a watch to the queue, reopen the watch when closed."""
+    while not stop.is_set():
+        w = watch.Watch()
+        try:
+            # without a resourceVersion, the watch starts with the current state
+            for event in w.stream(
+                list_func, namespace=namespace, timeout_seconds=WATCH_TIMEOUT
+            ):
+                events.put(event["object"])
+                if stop.is_set():
+                    w.stop()
+                    return
+        except (ApiException, urllib3.exceptions.HTTPError) as ex:
+            if stop.is_set():
+                return
+            if isinstance(ex, ApiException) and ex.status in (401, 403, 404):
+                events.put(ex)
+                return
+            # e.g. 410 Gone (expired resourceVersion) or a dropped connection
+            time.sleep(1)
+
+
+def wait_for_ready(
+    api_client: client.ApiClient,
+    namespace: str,
+    pods: Iterable[str],
+    deployments: Iterable[str],
+    timeout: float,
+) -> Dict[Tuple[str, str], Target]:
+    targets = {("pod", name): Target("pod", name) for name in pods}
+    targets.update(
+        {("deployment", name): Target("deployment", name) for name in deployments}
+    )
+    events: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    watches = []
+    if pods:
+        watches.append(client.CoreV1Api(api_client).list_namespaced_pod)
+    if deployments:
+        watches.append(client.AppsV1Api(api_client).list_namespaced_deployment)
+    for list_func in watches:
+        threading.Thread(
+            target=stream_events,
+            args=(list_func, namespace, events, stop),
+            daemon=True,
+        ).start()
+
+    start = time.monotonic()
+    pending = set(targets)
+    try:
+        while pending:
+            remaining = start + timeout - time.monotonic()
+            if remaining <= 0:
+                raise click.ClickException(
+                    f"Timed out after {timeout:.0f}s waiting for "
+                    + ", ".join(str(targets[key]) for key in sorted(pending))
+                )
+            try:
+                obj = events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if isinstance(obj, Exception):
+                raise click.ClickException(f"Watching the namespace failed: {obj}")
+
+            if isinstance(obj, client.V1Pod):
+                key, evaluate = ("pod", obj.metadata.name), pod_state
+            else:
+                key, evaluate = ("deployment", obj.metadata.name), deployment_state
+            if key not in pending:
+                continue
+
+            target = targets[key]
+            state, ready, failure = evaluate(obj)
+            elapsed = time.monotonic() - start
+            if state != target.state:
+                click.echo(f"[{elapsed:6.1f}s] {target}: {target.state} → {state}")
+                target.state = state
+            if failure:
+                raise click.ClickException(f"{target} failed: {failure}")
+            if ready:
+                target.ready_after = elapsed
+                pending.discard(key)
+    finally:
+        stop.set()
+    return targets
+
+
+def get_api_client(
+    host: Optional[str], api_key: Optional[str], validate_certs: bool
+) -> client.ApiClient:
+    if not host:
+        # e.g. a local kind/OpenShift Local cluster
+        config.load_kube_config()
+        return client.ApiClient()
+    configuration = client.Configuration()
+    configuration.host = host
+    configuration.verify_ssl = validate_certs
+    if api_key:
+        configuration.api_key = {"authorization": f"Bearer {api_key}"}
+    return client.ApiClient(configuration)
+
+
+@click.command()
+@click.option("--namespace", required=True, help="Namespace of the deployment.")
+@click.option(
+    "--pod", "pods", multiple=True, help="Pod to wait for to be Ready, repeatable."
+)
+@click.option(
+    "--deployment",
+    "deployments",
+    multiple=True,
+    help="Deployment to wait for to be rolled out, repeatable.",
+)
+@click.option(
+    "--timeout",
+    default=900,
+    show_default=True,
+    help="Seconds to wait for all the pods and deployments.",
+)
+@click.option(
+    "--host",
+    envvar="K8S_AUTH_HOST",
+    help="API server URL, current context of kubeconfig is used if not set.",
+)
+@click.option("--api-key", envvar="K8S_AUTH_API_KEY", help="API token.")
+@click.option(
+    "--validate-certs/--no-validate-certs",
+    envvar="K8S_AUTH_VERIFY_SSL",
+    default=True,
+    show_default=True,
+)
+def main(namespace, pods, deployments, timeout, host, api_key, validate_certs):
+    """Wait for pods to be Ready and deployments to be rolled out.
+
+    Finishes as soon as all of them are ready or any of them fails,
+    prints a timeline of their states.
+    """
+    if not validate_certs:
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    api_client = get_api_client(host, api_key, validate_certs)
+    targets = wait_for_ready(api_client, namespace, pods, deployments, timeout)
+
+    click.echo("Ready:")
+    for target in sorted(targets.values(), key=lambda target: target.ready_after):
+        click.echo(f"  {str(target):<50} after {target.ready_after:6.1f}s")
+
+
+if __name__ == "__main__":
+    main()